@@ -1,42 +1,123 @@
 import argparse
-import concurrent
+import concurrent.futures
+import ctypes
 import multiprocessing
+import os
+import queue
 import signal
 import sys
 from typing import List, Optional, Tuple
 
 from tqdm import tqdm
 
-from synth.pipelines import AbstractPipeline, CodecLMPipeline
-from synth.utils.dataset_utils import load_dataset
-from synth.utils.io_utils import aggregate_temp_files, load_yaml, save_results
+from synth.pipelines import PIPELINES, AbstractPipeline
+from synth.utils.dataset_utils import load_dataset, split_dataset
+from synth.utils.io_utils import (aggregate_temp_files, load_yaml, save_jsonl,
+                                 save_results)
+
+# State owned by the current worker process, set by `init_worker`
+_PIPELINE: Optional[AbstractPipeline] = None
+_WORKER_ID: Optional[int] = None
+_PROGRESS_COUNTERS: Optional[ctypes.Array] = None
+_DONE_QUEUE: Optional[multiprocessing.Queue] = None
+_STOP_EVENT: Optional[multiprocessing.Event] = None
+
+
+def init_worker(config: dict,
+                pipeline_name: str,
+                progress_counters: ctypes.Array,
+                done_queue: multiprocessing.Queue,
+                stop_event: multiprocessing.Event,
+                worker_counter: multiprocessing.Value,
+                cpu_affinity: bool = False) -> None:
+    """
+    Initialize a worker process by building its pipeline and assigning it its own progress counter.
+
+    The pipeline is built after the worker is started so each process owns its API clients,
+    and it is not pickled with every submitted chunk.
+
+    Args:
+        config (dict): the configuration used to build the pipeline
+        pipeline_name (str): the name of the pipeline to build, one of `PIPELINES`
+        progress_counters (ctypes.Array): one shared progress counter per worker
+        done_queue (multiprocessing.Queue): the queue used to signal the finished chunks
+        stop_event (multiprocessing.Event): the event set by the main process on interrupt
+        worker_counter (multiprocessing.Value): a shared counter used to hand out the worker ids
+        cpu_affinity (bool): whether to pin the worker to a single CPU core (Linux only)
+
+    Returns:
+        None
+    """
+    global _PIPELINE, _WORKER_ID, _PROGRESS_COUNTERS, _DONE_QUEUE, _STOP_EVENT
 
+    # Interrupts are handled by the main process, which asks the workers to stop through the stop event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-def process_chunk(pipeline: AbstractPipeline,
-                  dataset: List[str],
-                  process_id: int,
-                  progress_queue: Optional[multiprocessing.Queue] = None) -> Tuple[List[str], List[str], List[str]]:
+    with worker_counter.get_lock():
+        _WORKER_ID = worker_counter.value
+        worker_counter.value += 1
+
+    # Keep each worker on its own core so its caches are not thrashed by migrations across cores/sockets
+    if cpu_affinity and hasattr(os, "sched_setaffinity"):
+        available_cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {available_cpus[_WORKER_ID % len(available_cpus)]})
+
+    _PIPELINE = PIPELINES[pipeline_name](config)
+    _PROGRESS_COUNTERS = progress_counters
+    _DONE_QUEUE = done_queue
+    _STOP_EVENT = stop_event
+
+
+def report_progress(processed_count: int) -> None:
     """
-    Process a chunk of the dataset using the provided pipeline.
+    Add processed data points to the progress counter of the current worker.
 
     Args:
-        pipeline (AbstractPipeline): the pipeline to use
-        dataset (List[str]): the dataset to process
-        process_id (int): the process id
-        progress_queue (Optional[multiprocessing.Queue]): a queue to report progress
+        processed_count (int): the number of newly processed data points
 
     Returns:
-        Tuple[List[str], List[str], List[str]]: the generated dataset, the processed data, and the data that was not processed
+        None
+    """
+    # Each counter has a single writer, so no lock is needed
+    _PROGRESS_COUNTERS[_WORKER_ID] += processed_count
+
+
+def process_chunk(dataset: List[str], process_id: int) -> Tuple[Optional[str], str, str]:
     """
-    generated_dataset, processed_data, not_processed_data = pipeline.run_pipeline(dataset, progress_queue, process_id)
+    Process a chunk of the dataset with the pipeline of the current worker.
 
-    return generated_dataset, processed_data, not_processed_data
+    The outputs are written to temp jsonl files instead of being sent back to the main process.
 
+    Args:
+        dataset (List[str]): the dataset to process
+        process_id (int): the process id
 
-def create_signal_handler(output_path):
-    def handle_interrupt(signal, frame):
-        aggregate_temp_files(output_path)
-        sys.exit(0)
+    Returns:
+        Tuple[Optional[str], str, str]: the paths to the generated dataset (None when interrupted), the processed data,
+            and the data that was not processed
+    """
+    try:
+        generated_dataset, processed_data_file, _ = _PIPELINE.run_pipeline(dataset, report_progress, process_id, _STOP_EVENT)
+
+        # The final dataset is built while it is written, the processed and skipped data are already in the pipeline's checkpoints.
+        # An interrupted chunk has no final dataset, the main process only aggregates its checkpoints.
+        generated_dataset_file = None
+        if generated_dataset is not None:
+            generated_dataset_file = _PIPELINE.temp_file_path("generated_dataset", process_id)
+            save_jsonl(generated_dataset_file, generated_dataset)
+    finally:
+        # Sentinel telling the main process that this chunk is finished
+        _DONE_QUEUE.put(None)
+
+    return generated_dataset_file, processed_data_file, _PIPELINE.temp_file_path("skipped_data", process_id)
+
+
+def create_signal_handler(stop_event: multiprocessing.Event):
+    def handle_interrupt(signal_number, frame):
+        # Only flag the interrupt, the main loop stops the workers and aggregates the temp files.
+        # A second interrupt falls back to the default behaviour and aborts immediately.
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        stop_event.set()
     return handle_interrupt
 
 
@@ -52,6 +133,14 @@ if __name__ == "__main__":
                         type=int,
                         help="The number of parallel processes to use.",
                         default=1)
+    parser.add_argument("--pipeline",
+                        type=str,
+                        choices=list(PIPELINES),
+                        help="The pipeline to run.",
+                        default="codec_lm")
+    parser.add_argument("--cpu_affinity",
+                        action="store_true",
+                        help="Pin each worker process to its own CPU core (Linux only).")
 
     args = parser.parse_args()
 
@@ -61,58 +150,86 @@ if __name__ == "__main__":
     # Load the configuration file
     config = load_yaml(config_path)
 
-    # Register the signal handler
-    signal.signal(signal.SIGINT, create_signal_handler(config["pipeline"]["output_path"]))
-
-    # Initialize the pipeline
-    pipeline = CodecLMPipeline(config)
-
     # Load the dataset
     dataset = load_dataset(config["pipeline"]["dataset_path"])
 
-    chunk_size = len(dataset) // num_parallel_processes
-    chunks = [dataset[i:i + chunk_size] for i in range(0, len(dataset), chunk_size)]
+    chunks = split_dataset(dataset, num_parallel_processes)
+
+    # The workers write their temp files to the output path as they go
+    output_path = config["pipeline"]["output_path"]
+    os.makedirs(output_path, exist_ok=True)
 
     try:
-        with multiprocessing.Manager() as manager:
-            progress_queue = manager.Queue()
-            processed_data_counter = manager.Value('i', 0)
-            lock = manager.Lock()
-
-            total_data_points = sum(len(chunk) for chunk in chunks)
-            with tqdm(total=total_data_points, desc="a/chemy(ing) 🪄 ...") as progress_bar:
-                with concurrent.futures.ThreadPoolExecutor(max_workers=num_parallel_processes) as executor:
-                    futures = [
-                        executor.submit(
-                            process_chunk, pipeline, chunk, idx, progress_queue)
-                        for idx, chunk in enumerate(chunks)
-                    ]
-
-                    results = []
-                    while any(future.running() for future in futures):
-                        try:
-                            processed_count = progress_queue.get(timeout=1)
-                            progress_bar.update(processed_count)
-                        except Exception:
-                            pass
-
-                    for future in futures:
-                        results.append(future.result())
-
-        generated_dataset = []
-        processed_data = []
-        skipped_data = []
-
-        for result in results:
-            generated_dataset.extend(result[0])
-            processed_data.extend(result[1])
-            skipped_data.extend(result[2])
-
-        save_results(generated_dataset=generated_dataset,
-                     processed_data=processed_data,
-                     skipped_data=skipped_data,
-                     output_path=config["pipeline"]["output_path"])
+        # The pipeline holds API clients which are not fork-safe,
+        # so the workers are started from a clean server process and build their own.
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        mp_context = multiprocessing.get_context(start_method)
+
+        # Progress goes through lock-free shared counters, the queue only carries the end-of-chunk sentinels
+        progress_counters = mp_context.RawArray('i', num_parallel_processes)
+        done_queue = mp_context.Queue()
+        stop_event = mp_context.Event()
+        worker_counter = mp_context.Value('i', 0)
+
+        # Register the signal handler
+        signal.signal(signal.SIGINT, create_signal_handler(stop_event))
+
+        total_data_points = sum(len(chunk) for chunk in chunks)
+        with tqdm(total=total_data_points,
+                  desc="a/chemy(ing) 🪄 ...",
+                  mininterval=0.1,
+                  miniters=1,
+                  smoothing=0) as progress_bar:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=num_parallel_processes,
+                                                        mp_context=mp_context,
+                                                        initializer=init_worker,
+                                                        initargs=(config,
+                                                                  args.pipeline,
+                                                                  progress_counters,
+                                                                  done_queue,
+                                                                  stop_event,
+                                                                  worker_counter,
+                                                                  args.cpu_affinity)) as executor:
+                futures = [
+                    executor.submit(
+                        process_chunk, chunk, idx)
+                    for idx, chunk in enumerate(chunks)
+                ]
+
+                finished_chunks = 0
+                cancelled = False
+                while finished_chunks < len(chunks):
+                    if stop_event.is_set() and not cancelled:
+                        # The running chunks stop after their current data point, the pending ones never start
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        cancelled = True
+
+                    try:
+                        done_queue.get(timeout=0.1)
+                        finished_chunks += 1
+                    except queue.Empty:
+                        if all(future.done() for future in futures):
+                            # A worker died without sending its sentinel
+                            break
+
+                    progress_bar.update(sum(progress_counters) - progress_bar.n)
+
+                if stop_event.is_set():
+                    # Wait for the running chunks to write their last temp files before aggregating them
+                    executor.shutdown(wait=True)
+                    aggregate_temp_files(output_path)
+                    sys.exit(0)
+
+                # Only the paths of the chunk files come back, the rows are merged from disk in the chunks order
+                chunk_files = [future.result() for future in futures]
+
+        generated_dataset_files, processed_data_files, skipped_data_files = zip(*chunk_files)
+
+        save_results(generated_dataset_files=list(generated_dataset_files),
+                     processed_data_files=list(processed_data_files),
+                     skipped_data_files=list(skipped_data_files),
+                     output_path=output_path)
 
     except Exception as e:
-        aggregate_temp_files(config["pipeline"]["output_path"])
+        aggregate_temp_files(output_path)
         raise e
@@ -1,3 +1,281 @@
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Type
+
+import httpx
+from tenacity import (AsyncRetrying, retry_if_exception_type,
+                      stop_after_attempt, wait_exponential_jitter)
+
+from synth.utils.cache_utils import LRUCache, hash_key
+
+# Large keep-alive pool so concurrent requests reuse connections instead of queuing on the SDK defaults
+HTTP_LIMITS = httpx.Limits(max_connections=256, max_keepalive_connections=256)
+HTTP_TIMEOUT = 600.0
+
+_EVENT_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_EVENT_LOOP_LOCK = threading.Lock()
+
+_HTTP_CLIENTS: Dict[Callable[..., Any], Any] = {}
+_HTTP_CLIENTS_LOCK = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the event loop shared by all the engines of the current process.
+
+    The loop runs forever in a daemon thread, so the async clients (and their connection pools)
+    can be reused across calls and from any thread.
+
+    Returns:
+        asyncio.AbstractEventLoop: The shared event loop.
+    """
+    global _EVENT_LOOP
+
+    with _EVENT_LOOP_LOCK:
+        if _EVENT_LOOP is None:
+            _EVENT_LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_EVENT_LOOP.run_forever, name="synth-engines", daemon=True).start()
+
+    return _EVENT_LOOP
+
+
+def get_http_client(client_factory: Callable[..., Any]) -> Any:
+    """
+    Get the async HTTP client shared by all the engines of the current process built with `client_factory`.
+
+    Args:
+        client_factory (Callable[..., Any]): The SDK's async httpx client class (e.g. `openai.DefaultAsyncHttpxClient`).
+
+    Returns:
+        Any: The shared async HTTP client.
+    """
+    with _HTTP_CLIENTS_LOCK:
+        if client_factory not in _HTTP_CLIENTS:
+            _HTTP_CLIENTS[client_factory] = client_factory(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+    return _HTTP_CLIENTS[client_factory]
+
+
 class AbstactEngine:
-    def __call__():
+    # Transient API errors (rate limits, connection errors, 5xx) retried with a jittered exponential backoff
+    retry_exceptions: Tuple[Type[BaseException], ...] = ()
+    max_attempts: int = 6
+
+    # Whether the provider exposes an offline batch endpoint, and how often (in seconds) to poll a submitted batch
+    supports_batch: bool = False
+    batch_poll_interval: float = 30.
+
+    def __init__(self, max_concurrency: int, cache_size: int = 100_000) -> None:
+        """
+        Base class for the generation engines.
+
+        Args:
+            max_concurrency (int): The maximum number of requests in flight for this engine.
+            cache_size (int): The maximum number of greedy (temperature 0) completions kept in memory.
+
+        Returns:
+            None
+        """
+        self.max_concurrency = max_concurrency
+        self.batch_mode = False
+        # Static prompt prefixes the engines with explicit prompt caching mark as cacheable
+        self.cached_prefixes: Tuple[str, ...] = ()
+        self._semaphore = None
+        self._cache = LRUCache(maxsize=cache_size)
+
+    async def _agenerate(self,
+                         instruction: str,
+                         temperature: float,
+                         top_p: float,
+                         max_tokens: int) -> str:
+        """
+        Generate the completion for a single task prompt.
+
+        Args:
+            instruction (str): The task prompt.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            str: The completion for the task prompt.
+        """
         raise NotImplementedError
+
+    async def _agenerate_all(self, instructions: List[str], **generation_config) -> List[str]:
+        """
+        Generate the completions for a list of task prompts.
+
+        Greedy (temperature 0) completions are deterministic, so they are deduplicated
+        and served from the cache when the same prompt was already sent with the same parameters.
+
+        Args:
+            instructions (List[str]): A list of task prompts.
+            **generation_config: The sampling parameters forwarded to `_agenerate`.
+
+        Returns:
+            List[str]: A list of completions, in the same order as the task prompts.
+        """
+        if generation_config["temperature"] != 0:
+            return await self._agenerate_uncached(instructions, **generation_config)
+
+        keys = [hash_key(self.model, self.seed, *sorted(generation_config.items()), instruction) for instruction in instructions]
+        outputs = {key: self._cache.get(key) for key in keys}
+
+        missing = {key: instruction for key, instruction in zip(keys, instructions) if outputs[key] is None}
+        generated = await self._agenerate_uncached(list(missing.values()), **generation_config)
+
+        for key, output in zip(missing, generated):
+            outputs[key] = output
+
+            # Failed batch requests come back as None and must be retried on the next call
+            if output is not None:
+                self._cache.set(key, output)
+
+        return [outputs[key] for key in keys]
+
+    async def _agenerate_uncached(self, instructions: List[str], **generation_config) -> List[str]:
+        """
+        Generate the completions for a list of task prompts, concurrently or with a batch job.
+
+        Args:
+            instructions (List[str]): A list of task prompts.
+            **generation_config: The sampling parameters forwarded to `_agenerate`.
+
+        Returns:
+            List[str]: A list of completions, in the same order as the task prompts.
+        """
+        if self.batch_mode:
+            return await self._arun_batch(instructions, **generation_config)
+
+        # Created lazily so it is bound to the shared event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _generate_one(instruction: str) -> str:
+            async with self._semaphore:
+                async for attempt in AsyncRetrying(wait=wait_exponential_jitter(),
+                                                   stop=stop_after_attempt(self.max_attempts),
+                                                   retry=retry_if_exception_type(self.retry_exceptions),
+                                                   reraise=True):
+                    with attempt:
+                        return await self._agenerate(instruction, **generation_config)
+
+        return list(await asyncio.gather(*[_generate_one(instruction) for instruction in instructions]))
+
+    async def _arun_batch(self,
+                          instructions: List[str],
+                          temperature: float,
+                          top_p: float,
+                          max_tokens: int) -> List[Optional[str]]:
+        """
+        Generate the completions for a list of task prompts through the provider's batch endpoint.
+
+        Args:
+            instructions (List[str]): A list of task prompts.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            List[Optional[str]]: A list of completions, with None for the failed requests.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support the batch API")
+
+    def run_batch(self,
+                  instructions: List[str],
+                  temperature: float = 0.,
+                  top_p: float = 1.,
+                  max_tokens: int = 2048) -> List[Optional[str]]:
+        """
+        Generate completions for a list of task prompts with a single offline batch job.
+
+        Args:
+            instructions (List[str]): A list of task prompts.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            List[Optional[str]]: A list of completions, with None for the failed requests.
+        """
+        return self._run(self._arun_batch(instructions,
+                                          temperature=temperature,
+                                          top_p=top_p,
+                                          max_tokens=max_tokens))
+
+    def _run(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        """
+        Run a coroutine on the shared event loop and wait for its result.
+
+        Args:
+            coroutine (Coroutine): The coroutine to run.
+
+        Returns:
+            Any: The result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
+
+    def submit(self,
+               instructions: List[str],
+               temperature: float = 0.,
+               top_p: float = 1.,
+               max_tokens: int = 2048) -> concurrent.futures.Future:
+        """
+        Start generating completions for a list of task prompts, without waiting for them.
+
+        Args:
+            instructions (List[str]): A list of task prompts.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            concurrent.futures.Future: The future of the list of completions for the task prompts.
+        """
+        return asyncio.run_coroutine_threadsafe(self._agenerate_all(instructions,
+                                                                    temperature=temperature,
+                                                                    top_p=top_p,
+                                                                    max_tokens=max_tokens),
+                                                get_event_loop())
+
+    def __call__(self,
+                 instructions: List[str],
+                 temperature: float = 0.,
+                 top_p: float = 1.,
+                 max_tokens: int = 2048) -> List[Optional[str]]:
+        """
+        Generate completions for a list of task prompts.
+
+        Args:
+            instructions (List[str]): A list of task prompts.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            List[Optional[str]]: A list of completions for the task prompts, None for the failed batch requests.
+        """
+        return self.submit(instructions, temperature=temperature, top_p=top_p, max_tokens=max_tokens).result()
+
+    async def acall(self,
+                    instructions: List[str],
+                    temperature: float = 0.,
+                    top_p: float = 1.,
+                    max_tokens: int = 2048) -> List[Optional[str]]:
+        """
+        Generate completions for a list of task prompts, asynchronously.
+
+        The requests still run on the shared event loop, so this can be awaited from any other event loop.
+
+        Args:
+            instructions (List[str]): A list of task prompts.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            List[Optional[str]]: A list of completions for the task prompts, None for the failed batch requests.
+        """
+        return await asyncio.wrap_future(self.submit(instructions, temperature=temperature, top_p=top_p, max_tokens=max_tokens))
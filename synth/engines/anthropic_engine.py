@@ -1,12 +1,18 @@
+import asyncio
 import os
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 
-from anthropic import Anthropic
+from anthropic import (APIConnectionError, AsyncAnthropic,
+                       DefaultAsyncHttpxClient, InternalServerError,
+                       RateLimitError)
 
-from .abstract_engine import AbstactEngine
+from .abstract_engine import AbstactEngine, get_http_client
 
 
 class AnthropicEngine(AbstactEngine):
+    retry_exceptions = (RateLimitError, APIConnectionError, InternalServerError)
+    supports_batch = True
+
     @staticmethod
     def from_config(config: Dict[str, str]) -> 'AnthropicEngine':
         """
@@ -19,30 +25,101 @@ class AnthropicEngine(AbstactEngine):
             GenerationEngine: The engine created from the configuration.
         """
         return AnthropicEngine(model=config['model'],
-                               seed=int(config['seed']))
+                               seed=int(config['seed']),
+                               max_concurrency=int(config.get('max_concurrency') or 16),
+                               cache_size=int(config.get('cache_size') or 100_000))
 
-    def __init__(self, model: str, seed: int) -> None:
+    def __init__(self, model: str, seed: int, max_concurrency: int = 16, cache_size: int = 100_000) -> None:
         """
         Engine for generating completions using the Anthropic API.
 
         Args:
             model (str): The model to use for generation.
             seed (int): The seed to use for generation.
+            max_concurrency (int): The maximum number of requests in flight.
+            cache_size (int): The maximum number of greedy completions kept in memory.
 
         Returns:
             None
         """
-        self.engine = Anthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"))
+        super().__init__(max_concurrency, cache_size)
+        self.engine = AsyncAnthropic(api_key=os.environ.get("ANTHROPIC_API_KEY"),
+                                     http_client=get_http_client(DefaultAsyncHttpxClient),
+                                     max_retries=0)
         self.model = model
         self.seed = seed
 
-    def __call__(self,
-                 instructions: List[str],
-                 temperature: float = 0.,
-                 top_p: float = 1.,
-                 max_tokens: int = 2048) -> List[str]:
+    def _build_content(self, instruction: str) -> List[Dict[str, Any]]:
+        """
+        Build the content blocks of a task prompt, with its static prefix (if any) marked for prompt caching.
+
+        Args:
+            instruction (str): The task prompt.
+
+        Returns:
+            List[Dict[str, Any]]: The content blocks.
+        """
+        for prefix in self.cached_prefixes:
+            if len(instruction) > len(prefix) and instruction.startswith(prefix):
+                return [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+                        {"type": "text", "text": instruction[len(prefix):]}]
+
+        return [{"type": "text", "text": instruction}]
+
+    def _build_request(self,
+                       instruction: str,
+                       temperature: float,
+                       top_p: float,
+                       max_tokens: int) -> Dict[str, Any]:
+        """
+        Build the parameters of a messages request.
+
+        Args:
+            instruction (str): The task prompt.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            Dict[str, Any]: The request parameters.
+        """
+        return {"model": self.model,
+                "messages": [{"role": "user", "content": self._build_content(instruction)}],
+                "temperature": temperature,
+                "top_p": top_p,
+                "max_tokens": max_tokens}
+
+    async def _agenerate(self,
+                         instruction: str,
+                         temperature: float,
+                         top_p: float,
+                         max_tokens: int) -> str:
         """
-        Generate completions for a list of task prompts.
+        Generate the completion for a single task prompt.
+
+        Args:
+            instruction (str): The task prompt.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            str: The completion for the task prompt.
+        """
+        completion = await self.engine.messages.create(**self._build_request(instruction,
+                                                                             temperature,
+                                                                             top_p,
+                                                                             max_tokens))
+
+        return completion.content[0].text
+
+    async def _arun_batch(self,
+                          instructions: List[str],
+                          temperature: float,
+                          top_p: float,
+                          max_tokens: int) -> List[Optional[str]]:
+        """
+        Generate the completions for a list of task prompts through the Anthropic Message Batches API.
 
         Args:
             instructions (List[str]): A list of task prompts.
@@ -51,18 +128,23 @@ class AnthropicEngine(AbstactEngine):
             max_tokens (int): The maximum number of tokens to generate.
 
         Returns:
-            List[str]: A list of completions for the task prompts.
+            List[Optional[str]]: A list of completions, with None for the failed requests.
         """
-        outputs = []
-
-        for instruction in instructions:
-            message = [{"role": "user", "content": [{"type": "text", "text": instruction}]}]
-            completion = self.engine.messages.create(
-                model=self.model,
-                messages=message,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens)
-            outputs.append(completion.content[0].text)
+        outputs = [None] * len(instructions)
+
+        if not instructions:
+            return outputs
+
+        requests = [{"custom_id": str(idx), "params": self._build_request(instruction, temperature, top_p, max_tokens)}
+                    for idx, instruction in enumerate(instructions)]
+        batch = await self.engine.messages.batches.create(requests=requests)
+
+        while batch.processing_status != "ended":
+            await asyncio.sleep(self.batch_poll_interval)
+            batch = await self.engine.messages.batches.retrieve(batch.id)
+
+        async for result in await self.engine.messages.batches.results(batch.id):
+            if result.result.type == "succeeded":
+                outputs[int(result.custom_id)] = result.result.message.content[0].text
 
         return outputs
@@ -3,25 +3,27 @@ from .anthropic_engine import AnthropicEngine
 from .mistral_engine import MistralEngine
 from .openai_engine import OpenAIEngine
 
+_ENGINES = {
+    "anthropic": AnthropicEngine.from_config,
+    "openai": OpenAIEngine.from_config,
+    "togetherai": OpenAIEngine.from_config,
+    "mistralai": MistralEngine.from_config,
+}
+
 
 def build_engine(config: dict) -> AbstactEngine:
     """
-    Build an engine from a string.
+    Build an engine from a configuration dictionary.
 
     Args:
-        engine (str): The engine to build.
+        config (dict): The configuration of the engine to build.
 
     Returns:
-        AbstactEngine: The engine built from the string.
+        AbstactEngine: The engine built from the configuration.
     """
-    if config["engine"] == "anthropic":
-        return AnthropicEngine.from_config(config)
-    elif config["engine"] == "openai":
-        return OpenAIEngine.from_config(config)
-    elif config["engine"] == "togetherai":
-        return OpenAIEngine.from_config(config)
-    elif config["engine"] == "mistralai":
-        return MistralEngine.from_config(config)
-    else:
-        raise ValueError(f"Invalid engine: {config['engine']}. Please choose from \
-                         'anthropic', 'openai', 'togetherai', or 'mistralai'")
+    try:
+        engine_builder = _ENGINES[config["engine"]]
+    except KeyError:
+        raise ValueError(f"Invalid engine: {config['engine']}. Please choose from {', '.join(map(repr, _ENGINES))}")
+
+    return engine_builder(config)
@@ -1,13 +1,16 @@
 import os
-from typing import Dict, List
+from typing import Dict
 
-from mistralai.client import MistralClient
-from mistralai.models.chat_completion import ChatMessage
+from mistralai.async_client import MistralAsyncClient
+from mistralai.exceptions import (MistralAPIStatusException,
+                                  MistralConnectionException)
 
 from .abstract_engine import AbstactEngine
 
 
 class MistralEngine(AbstactEngine):
+    retry_exceptions = (MistralAPIStatusException, MistralConnectionException)
+
     @staticmethod
     def from_config(config: Dict[str, str]) -> 'MistralEngine':
         """
@@ -20,51 +23,55 @@ class MistralEngine(AbstactEngine):
             GenerationEngine: The engine created from the configuration.
         """
         return MistralEngine(model=config['model'],
-                             seed=int(config['seed']))
+                             seed=int(config['seed']),
+                             max_concurrency=int(config.get('max_concurrency') or 16),
+                             cache_size=int(config.get('cache_size') or 100_000))
 
-    def __init__(self, model: str, seed: int) -> None:
+    def __init__(self, model: str, seed: int, max_concurrency: int = 16, cache_size: int = 100_000) -> None:
         """
         Engine for generating completions using the MistralAI API.
 
         Args:
             model (str): The model to use for generation.
             seed (int): The seed to use for generation.
+            max_concurrency (int): The maximum number of requests in flight.
+            cache_size (int): The maximum number of greedy completions kept in memory.
 
         Returns:
             None
         """
-        self.engine = MistralClient(api_key=os.environ.get('MISTRAL_API_KEY'))
+        super().__init__(max_concurrency, cache_size)
+        # The Mistral client does not accept an external HTTP client, so only its pool size is configured
+        self.engine = MistralAsyncClient(api_key=os.environ.get('MISTRAL_API_KEY'),
+                                         max_retries=0,
+                                         max_concurrent_requests=max_concurrency)
         self.model = model
         self.seed = seed
 
-    def __call__(self,
-                 instructions: List[str],
-                 temperature: float = 0.,
-                 top_p: float = 1.,
-                 max_tokens: int = 2048) -> List[str]:
+    async def _agenerate(self,
+                         instruction: str,
+                         temperature: float,
+                         top_p: float,
+                         max_tokens: int) -> str:
         """
-        Generate completions for a list of task prompts.
+        Generate the completion for a single task prompt.
 
         Args:
-            instructions (List[str]): A list of task prompts.
+            instruction (str): The task prompt.
             temperature (float): The temperature to use for sampling.
             top_p (float): The top_p to use for sampling.
             max_tokens (int): The maximum number of tokens to generate.
 
         Returns:
-            List[str]: A list of completions for the task prompts.
+            str: The completion for the task prompt.
         """
-        output = []
-
-        for instruction in instructions:
-            completion = self.engine.chat(
-                model=self.model,
-                messages=[ChatMessage(role="user", content=instruction)],
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-                seed=self.seed)
-
-            output.append(completion.choices[0].message.content)
+        completion = await self.engine.chat(
+            model=self.model,
+            # Plain dicts are sent as-is, a ChatMessage would be validated then dumped back to a dict
+            messages=[{"role": "user", "content": instruction}],
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            seed=self.seed)
 
-        return output
+        return completion.choices[0].message.content
@@ -1,12 +1,18 @@
+import asyncio
 import os
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 
-from openai import OpenAI
+import orjson
+from openai import (APIConnectionError, AsyncOpenAI, DefaultAsyncHttpxClient,
+                    InternalServerError, RateLimitError)
 
-from .abstract_engine import AbstactEngine
+from .abstract_engine import AbstactEngine, get_http_client
 
 
 class OpenAIEngine(AbstactEngine):
+    retry_exceptions = (RateLimitError, APIConnectionError, InternalServerError)
+    supports_batch = True
+
     @staticmethod
     def from_config(config: Dict[str, str]) -> 'OpenAIEngine':
         """
@@ -20,28 +26,35 @@ class OpenAIEngine(AbstactEngine):
         """
         return OpenAIEngine(engine=config['engine'],
                             model=config['model'],
-                            seed=int(config['seed']))
+                            seed=int(config['seed']),
+                            max_concurrency=int(config.get('max_concurrency') or 16),
+                            cache_size=int(config.get('cache_size') or 100_000))
 
     def __init__(self,
-                 engine: OpenAI,
+                 engine: str,
                  model: str,
-                 seed: int) -> None:
+                 seed: int,
+                 max_concurrency: int = 16,
+                 cache_size: int = 100_000) -> None:
         """
         Engine for generating completions using the OpenAI API.
 
         Args:
-            engine (OpenAI): The OpenAI engine to use for generation.
+            engine (str): The OpenAI engine to use for generation.
             model (str): The model to use for generation.
             seed (int): The seed to use for generation.
+            max_concurrency (int): The maximum number of requests in flight.
+            cache_size (int): The maximum number of greedy completions kept in memory.
 
         Returns:
             None
         """
+        super().__init__(max_concurrency, cache_size)
         self.engine = self._build_engine(engine)
         self.model = model
         self.seed = seed
 
-    def _build_engine(self, engine: str) -> OpenAI:
+    def _build_engine(self, engine: str) -> AsyncOpenAI:
         """
         Build the generation engine.
 
@@ -49,23 +62,77 @@ class OpenAIEngine(AbstactEngine):
             engine (str): The generation engine to build.
 
         Returns:
-            OpenAI: The generation engine.
+            AsyncOpenAI: The generation engine.
         """
+        http_client = get_http_client(DefaultAsyncHttpxClient)
+
         if engine == "openai":
-            return OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+            return AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'),
+                               http_client=http_client,
+                               max_retries=0)
         elif engine == "togetherai":
-            return OpenAI(api_key=os.environ.get('TOGETHER_API_KEY'),
-                          base_url='https://api.together.xyz/v1')
+            return AsyncOpenAI(api_key=os.environ.get('TOGETHER_API_KEY'),
+                               base_url='https://api.together.xyz/v1',
+                               http_client=http_client,
+                               max_retries=0)
         else:
             raise ValueError(f"Invalid engine for OpenAI: {engine}. Please choose from 'openai' or 'togetherai'")
 
-    def __call__(self,
-                 instructions: List[str],
-                 temperature: float = 0.,
-                 top_p: float = 1.,
-                 max_tokens: int = 2048) -> List[str]:
+    def _build_request(self,
+                       instruction: str,
+                       temperature: float,
+                       top_p: float,
+                       max_tokens: int) -> Dict[str, Any]:
         """
-        Generate completions for a list of task prompts.
+        Build the body of a chat completion request.
+
+        Args:
+            instruction (str): The task prompt.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            Dict[str, Any]: The request body.
+        """
+        return {"model": self.model,
+                "messages": [{"role": "user", "content": instruction}],
+                "temperature": temperature,
+                "top_p": top_p,
+                "max_tokens": max_tokens,
+                "seed": self.seed}
+
+    async def _agenerate(self,
+                         instruction: str,
+                         temperature: float,
+                         top_p: float,
+                         max_tokens: int) -> str:
+        """
+        Generate the completion for a single task prompt.
+
+        Args:
+            instruction (str): The task prompt.
+            temperature (float): The temperature to use for sampling.
+            top_p (float): The top_p to use for sampling.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            str: The completion for the task prompt.
+        """
+        completion = await self.engine.chat.completions.create(**self._build_request(instruction,
+                                                                                      temperature,
+                                                                                      top_p,
+                                                                                      max_tokens))
+
+        return completion.choices[0].message.content
+
+    async def _arun_batch(self,
+                          instructions: List[str],
+                          temperature: float,
+                          top_p: float,
+                          max_tokens: int) -> List[Optional[str]]:
+        """
+        Generate the completions for a list of task prompts through the OpenAI Batch API.
 
         Args:
             instructions (List[str]): A list of task prompts.
@@ -74,21 +141,39 @@ class OpenAIEngine(AbstactEngine):
             max_tokens (int): The maximum number of tokens to generate.
 
         Returns:
-            List[str]: A list of completions for the task prompts.
+            List[Optional[str]]: A list of completions, with None for the failed requests.
         """
-        outputs = []
+        outputs = [None] * len(instructions)
+
+        if not instructions:
+            return outputs
+
+        requests = [{"custom_id": str(idx),
+                     "method": "POST",
+                     "url": "/v1/chat/completions",
+                     "body": self._build_request(instruction, temperature, top_p, max_tokens)}
+                    for idx, instruction in enumerate(instructions)]
+        batch_content = b"".join(orjson.dumps(request, option=orjson.OPT_APPEND_NEWLINE) for request in requests)
+        batch_file = await self.engine.files.create(file=("batch.jsonl", batch_content), purpose="batch")
+
+        batch = await self.engine.batches.create(input_file_id=batch_file.id,
+                                                 endpoint="/v1/chat/completions",
+                                                 completion_window="24h")
+
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            await asyncio.sleep(self.batch_poll_interval)
+            batch = await self.engine.batches.retrieve(batch.id)
+
+        if batch.output_file_id is None:
+            return outputs
 
-        for instruction in instructions:
-            message = [{"role": "user", "content": instruction}]
+        batch_output = await self.engine.files.content(batch.output_file_id)
 
-            completion = self.engine.chat.completions.create(
-                model=self.model,
-                messages=message,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-                seed=self.seed)
+        for line in batch_output.content.splitlines():
+            result = orjson.loads(line)
+            response = result.get("response")
 
-            outputs.append(completion.choices[0].message.content)
+            if response is not None and response["status_code"] == 200:
+                outputs[int(result["custom_id"])] = response["body"]["choices"][0]["message"]["content"]
 
         return outputs
@@ -1,55 +1,124 @@
+import asyncio
+import concurrent.futures
 import os
-from multiprocessing import Queue
-from typing import Dict, List, Optional, Tuple, Union
+from collections import Counter
+from dataclasses import dataclass, field
+from multiprocessing.synchronize import Event
+from typing import (Any, Callable, Dict, Iterator, List, Optional, Set, Tuple,
+                    Union)
+
+import numpy as np
 
 from synth.engines import build_engine
-from synth.synth_data_generator import (analyze_instructions,
+from synth.prompts import CACHEABLE_PROMPT_PREFIXES
+from synth.synth_data_generator import (ainstruction_answer,
+                                        analyze_instructions,
                                         build_final_dataset,
                                         contrastive_filtering,
                                         generate_actions,
                                         generate_instructions,
-                                        improve_instructions,
-                                        instruction_answer)
-from synth.utils.io_utils import save_json
-from synth.utils.pipeline_utils import sample_random_action_and_rubric
+                                        improve_instructions)
+from synth.utils.batch_scheduler import (DEFAULT_LENGTH_BUCKETS,
+                                         approximate_token_count,
+                                         group_by_bucket)
+from synth.utils.cache_utils import DiskCache, LRUCache, hash_key
+from synth.utils.io_utils import (append_jsonl, iter_jsonl, load_checkpoint,
+                                 save_jsonl)
+from synth.utils.pipeline_utils import (ImprovementRecord,
+                                        sample_random_action_and_rubric)
+
+
+@dataclass
+class SeedState:
+    """
+    The intermediate results of a seed instruction while its mini-batch goes through the pipeline stages.
+
+    The improved instructions of all the seeds of a mini-batch are generated and answered as one flat list,
+    the seed's own ones are found at `offset` in that list.
+    """
+    index: int
+    seed_instruction: str
+    task: str
+    skills: str
+    generated_instructions: List[str] = field(default_factory=list)
+    rubrics: List[str] = field(default_factory=list)
+    actions: List[str] = field(default_factory=list)
+    sampled_rubrics: List[str] = field(default_factory=list)
+    sampled_actions: List[str] = field(default_factory=list)
+    offset: int = 0
+
+
+def _unwrap(value: Union[str, List[str]]) -> str:
+    """
+    Unwrap the value of a single-element list.
+
+    Args:
+        value (Union[str, List[str]]): The value or the single-element list holding it.
+
+    Returns:
+        str: The value.
+    """
+    return value[0] if isinstance(value, list) else value
 
 
 class AbstractPipeline:
-    def init_engines(self, config: dict) -> None:
+    def init_pipeline(self, config: dict) -> None:
         """
-        Initialize the engines.
+        Initialize the engines and the configurations of the pipeline.
 
         Args:
-            config (dict): The configuration for the engines.
+            config (dict): The configuration for the pipeline.
 
         Returns:
             None
         """
-        self.strong_engine = build_engine(config["strong_model"])
-        self.target_engine = build_engine(config["target_model"])
-
-        if "judge_model" in config.keys() and config["judge_model"]:
-            self.judge_engine = build_engine(config["judge_model"])
-        else:
-            self.judge_engine = None
-
-    def init_configs(self, config: dict):
         # General configs
         self.strong_model_config = config["strong_model"]
         self.target_model_config = config["target_model"]
         self.pipeline_config = config["pipeline"]
 
         # Model names
-        self.strong_model_name = config["strong_model"]["model"]
-        self.target_model_name = config["target_model"]["model"]
+        self.strong_model_name = self.strong_model_config["model"]
+        self.target_model_name = self.target_model_config["model"]
+
+        # Engines
+        self.strong_engine = build_engine(self.strong_model_config)
+        self.target_engine = build_engine(self.target_model_config)
+
+        # Judge model, optional
+        self.judge_model_config = config.get("judge_model") or None
 
-        # Judge model
-        if "judge_model" in config.keys() and config["judge_model"]:
-            self.judge_model_name = config["judge_model"]["model"]
-            self.judge_model_config = config["judge_model"]
+        if self.judge_model_config is not None:
+            self.judge_model_name = self.judge_model_config["model"]
+            self.judge_engine = build_engine(self.judge_model_config)
         else:
             self.judge_model_name = None
-            self.judge_model_config = None
+            self.judge_engine = None
+
+        # Engines without a batch endpoint keep sending online requests
+        if self.pipeline_config.get("batch_mode", False):
+            for engine in (self.strong_engine, self.target_engine, self.judge_engine):
+                if engine is not None:
+                    engine.batch_mode = engine.supports_batch
+
+        for engine in (self.strong_engine, self.target_engine, self.judge_engine):
+            if engine is not None:
+                engine.cached_prefixes = CACHEABLE_PROMPT_PREFIXES
+
+    def temp_file_path(self, name: str, process_id: Optional[int] = None) -> str:
+        """
+        Get the path of a temp jsonl file written by the pipeline.
+
+        Args:
+            name (str): The name of the data saved in the file (e.g. "processed_data").
+            process_id (Optional[int], optional): The process id. Defaults to None.
+
+        Returns:
+            str: The path of the temp file in the output path.
+        """
+        process_id = process_id if process_id is not None else "0"
+
+        return os.path.join(self.pipeline_config["output_path"], f"_temp_{name}_{process_id}.jsonl")
 
     def run_pipeline(self):
         raise NotImplementedError
@@ -63,8 +132,84 @@ class CodecLMPipeline(AbstractPipeline):
         Args:
             config (dict): The configuration for the pipeline.
         """
-        self.init_engines(config)
-        self.init_configs(config)
+        self.init_pipeline(config)
+        self.init_score_caches(config)
+
+    def init_score_caches(self, config: dict) -> None:
+        """
+        Initialize the caches of the contrastive scores.
+
+        Args:
+            config (dict): The configuration for the pipeline.
+
+        Returns:
+            None
+        """
+        self.score_cache = LRUCache(maxsize=config["pipeline"].get("cache_size") or 100_000)
+
+        # Persisted so the scores are shared by the workers and reused across runs
+        if config["pipeline"].get("cache_dir"):
+            self.score_disk_cache = DiskCache(os.path.join(config["pipeline"]["cache_dir"], "contrastive_scores.sqlite"))
+        else:
+            self.score_disk_cache = None
+
+    def score_answers(self,
+                      instructions: List[str],
+                      target_answers: List[str],
+                      strong_answers: List[str]) -> Tuple[List[Optional[float]], List[Optional[float]]]:
+        """
+        Score the target and strong answers to the instructions with the contrastive filtering, reusing the cached scores.
+
+        The answers that are not cached are all scored with one batched contrastive filtering.
+
+        Args:
+            instructions (List[str]): The instructions.
+            target_answers (List[str]): The answers of the target model.
+            strong_answers (List[str]): The answers of the strong model.
+
+        Returns:
+            Tuple[List[Optional[float]], List[Optional[float]]]: The target and strong scores, None where the answers could not be scored.
+        """
+        generation_config = self.strong_model_config["generation_config"]
+        keys = [hash_key(self.strong_model_name, *sorted(generation_config.items()), instruction, strong_answer, target_answer)
+                for instruction, strong_answer, target_answer in zip(instructions, strong_answers, target_answers)]
+
+        all_scores = []
+        for instruction, target_answer, strong_answer, key in zip(instructions, target_answers, strong_answers, keys):
+            # The failed requests cannot be scored
+            if instruction is None or target_answer is None or strong_answer is None:
+                all_scores.append([None, None])
+                continue
+
+            scores = self.score_cache.get(key)
+            if scores is None and self.score_disk_cache is not None:
+                scores = self.score_disk_cache.get(key)
+
+                if scores is not None:
+                    self.score_cache.set(key, scores)
+
+            all_scores.append(scores)
+
+        missing = [idx for idx, scores in enumerate(all_scores) if scores is None]
+        if missing:
+            target_scores, strong_scores = contrastive_filtering([instructions[idx] for idx in missing],
+                                                                 [target_answers[idx] for idx in missing],
+                                                                 [strong_answers[idx] for idx in missing],
+                                                                 self.strong_engine,
+                                                                 generation_config,
+                                                                 short_circuit=self.pipeline_config.get("contrastive_short_circuit", False))
+
+            for idx, target_score, strong_score in zip(missing, target_scores, strong_scores):
+                all_scores[idx] = [target_score, strong_score]
+
+                # The failed scorings are not cached so they are retried
+                if target_score is not None and strong_score is not None:
+                    self.score_cache.set(keys[idx], [target_score, strong_score])
+
+                    if self.score_disk_cache is not None:
+                        self.score_disk_cache.set(keys[idx], [target_score, strong_score])
+
+        return [scores[0] for scores in all_scores], [scores[1] for scores in all_scores]
 
     def build_improvement_dict(self,
                                iteration: int,
@@ -75,9 +220,9 @@ class CodecLMPipeline(AbstractPipeline):
                                strong_answer: str,
                                target_answer: str,
                                strong_score: float,
-                               target_score: float) -> Dict[str, Union[str, float]]:
+                               target_score: float) -> ImprovementRecord:
         """
-        Build a dictionary to store the improvement tracking.
+        Build a record to store the improvement tracking.
 
         Args:
             iteration (int): The iteration number.
@@ -91,29 +236,70 @@ class CodecLMPipeline(AbstractPipeline):
             target_score (float): The score for the target answer.
 
         Returns:
-            dict: The improvement dictionary.
+            ImprovementRecord: The improvement record.
         """
-        rubric = rubric[0] if isinstance(rubric, list) else rubric
-        action = action[0] if isinstance(action, list) else action
-
-        improvement_dict = {}
-        improvement_dict["improvement_step"] = iteration
-        improvement_dict["original_instruction"] = original_instruction
-        improvement_dict["rubric"] = rubric
-        improvement_dict["action"] = action
-        improvement_dict["improved_instruction"] = improved_instruction
-        improvement_dict["strong_answer"] = strong_answer[0] if isinstance(strong_answer, list) else strong_answer
-        improvement_dict["target_answer"] = target_answer[0] if isinstance(target_answer, list) else target_answer
-        improvement_dict["strong_score"] = strong_score
-        improvement_dict["target_score"] = target_score
-
-        return improvement_dict
+        return ImprovementRecord(improvement_step=iteration,
+                                 original_instruction=original_instruction,
+                                 rubric=_unwrap(rubric),
+                                 action=_unwrap(action),
+                                 improved_instruction=improved_instruction,
+                                 strong_answer=_unwrap(strong_answer),
+                                 target_answer=_unwrap(target_answer),
+                                 strong_score=strong_score,
+                                 target_score=target_score)
+
+    def answer_instructions(self, instructions: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Generate the target and strong answers to the instructions concurrently.
+
+        The instructions are grouped by length with `length_buckets` and sorted by length, then sent in buckets of
+        at most `bucket_size` instructions, so the prompts batched together by the inference servers have similar
+        lengths and waste less padding.
+
+        Args:
+            instructions (List[str]): The instructions to answer.
+
+        Returns:
+            Tuple[List[str], List[str]]: The target answers and the strong answers.
+        """
+        # The instructions whose improvement failed are not answered, their answers are None
+        answerable = [idx for idx, instruction in enumerate(instructions) if instruction is not None]
+
+        buckets = []
+        for group in group_by_bucket([instructions[idx] for idx in answerable],
+                                     approximate_token_count,
+                                     self.pipeline_config.get("length_buckets") or DEFAULT_LENGTH_BUCKETS):
+            group = [answerable[idx] for idx in group]
+            bucket_size = self.pipeline_config.get("bucket_size") or len(group)
+            buckets.extend(group[start:start + bucket_size] for start in range(0, len(group), bucket_size))
+
+        async def _answer_instructions() -> List[List[str]]:
+            return await asyncio.gather(*[ainstruction_answer([instructions[idx] for idx in bucket],
+                                                              engine,
+                                                              model_config["generation_config"])
+                                          for engine, model_config in ((self.target_engine, self.target_model_config),
+                                                                       (self.strong_engine, self.strong_model_config))
+                                          for bucket in buckets])
+
+        bucket_answers = asyncio.run(_answer_instructions())
+
+        # Put the answers of each engine back in the order of the instructions
+        target_answers = [None] * len(instructions)
+        strong_answers = [None] * len(instructions)
+
+        for answers, engine_bucket_answers in ((target_answers, bucket_answers[:len(buckets)]),
+                                               (strong_answers, bucket_answers[len(buckets):])):
+            for bucket, answers_of_bucket in zip(buckets, engine_bucket_answers):
+                for idx, answer in zip(bucket, answers_of_bucket):
+                    answers[idx] = answer
+
+        return target_answers, strong_answers
 
     def iterative_contrastive_filtering(self,
                                         instruction: str,
                                         actions: List[str],
                                         rubrics: List[str],
-                                        margin: float) -> List[Dict[str, str]]:
+                                        margin: float) -> Optional[List[ImprovementRecord]]:
         """
         Make the instructions harder.
 
@@ -124,52 +310,54 @@ class CodecLMPipeline(AbstractPipeline):
             margin (float): The margin between the strong and target scores.
 
         Returns:
-            List[Dict[str, str]]: The list of improvements.
+            Optional[List[ImprovementRecord]]: The list of improvements, None if an improved instruction could not be scored.
         """
         n_iterations = self.pipeline_config["n_iterations"]
         margin_threshold = self.pipeline_config["margin_threshold"]
 
+        # Stop early once the margin stopped improving by `min_improvement_delta` for `patience` iterations (disabled by default)
+        min_improvement_delta = self.pipeline_config.get("min_improvement_delta")
+        patience = self.pipeline_config.get("patience") or 2
+
         improvement_tree = []
         if n_iterations > 0:
             iteration = 0
-            all_sampled_indices = []
+            stalled_iterations = 0
+            all_sampled_indices = Counter()
 
             while margin <= margin_threshold and iteration < n_iterations:
-                improvement_dict = {}
-
                 # Sample a random action and rubric
-                sampled_rubric, sampled_action, sampled_indices = sample_random_action_and_rubric(rubrics,
-                                                                                                  actions,
-                                                                                                  n_instructions=1,
-                                                                                                  prev_samples=all_sampled_indices)
+                sampled_rubrics, sampled_actions, sampled_indices = sample_random_action_and_rubric(rubrics,
+                                                                                                    actions,
+                                                                                                    n_instructions=1,
+                                                                                                    prev_samples=all_sampled_indices)
+                sampled_rubric = sampled_rubrics[0]
+                sampled_action = sampled_actions[0]
 
                 # Improve the instruction
-                improved_instruction = improve_instructions(instruction,
-                                                            sampled_action,
+                improved_instruction = improve_instructions([instruction],
+                                                            [sampled_action],
                                                             self.strong_engine,
                                                             self.strong_model_config["generation_config"])[0]
 
                 # Get the answers for the harder instruction
-                target_answer = instruction_answer(improved_instruction,
-                                                   self.target_engine,
-                                                   self.target_model_config["generation_config"])
-                strong_answer = instruction_answer(improved_instruction,
-                                                   self.strong_engine,
-                                                   self.strong_model_config["generation_config"])
+                (target_answer,), (strong_answer,) = self.answer_instructions([improved_instruction])
 
                 # Get the scores
-                target_score, strong_score = contrastive_filtering(improved_instruction,
-                                                                   target_answer,
-                                                                   strong_answer,
-                                                                   self.strong_engine,
-                                                                   self.strong_model_config["generation_config"])
+                (target_score,), (strong_score,) = self.score_answers([improved_instruction], [target_answer], [strong_answer])
 
                 if target_score is None or strong_score is None:
                     return None
 
+                previous_margin = margin
                 margin = abs(strong_score - target_score)
                 iteration += 1
 
+                if min_improvement_delta is not None and margin - previous_margin < min_improvement_delta:
+                    stalled_iterations += 1
+                else:
+                    stalled_iterations = 0
+
                 improvement_dict = self.build_improvement_dict(iteration=iteration,
                                                                original_instruction=instruction,
                                                                action=sampled_action,
@@ -180,108 +368,129 @@ class CodecLMPipeline(AbstractPipeline):
                                                                strong_score=strong_score,
                                                                target_score=target_score)
 
-                all_sampled_indices.extend(sampled_indices)
+                all_sampled_indices.update(sampled_indices)
                 improvement_tree.append(improvement_dict)
                 instruction = improved_instruction
 
+                if min_improvement_delta is not None and stalled_iterations >= patience:
+                    break
+
         return improvement_tree
 
-    def run_pipeline(self,
-                     dataset: List[str],
-                     progress_queue: Optional[Queue] = None,
-                     process_id: Optional[int] = None) -> Tuple[List[Dict[str, str]], List[Dict[str, str]], List[int]]:
+    def process_batch(self,
+                      indices: List[int],
+                      seed_instructions: List[str]) -> Tuple[List[Dict[str, str]], List[int]]:
         """
-        Run the pipeline on the dataset.
+        Run a mini-batch of seed instructions through the pipeline.
+
+        Each stage sends the prompts of all the seeds of the mini-batch to the engine at once.
 
         Args:
-            dataset (List[str]): The dataset to run the pipeline on.
-            progress_queue (Optional[Queue], optional): The queue to store the progress. Defaults to None.
-            process_id (Optional[int], optional): The process id. Defaults to None.
+            indices (List[int]): The indices of the seed instructions in the dataset.
+            seed_instructions (List[str]): The seed instructions.
 
         Returns:
-            Tuple[List[Dict[str, str]], List[Dict[str, str]], List[int]]: The improvement tree, the not processed data, and the processed data.
+            Tuple[List[Dict[str, str]], List[int]]: The processed data and the indices of the data that was not processed.
         """
+        n_instructions = self.pipeline_config["n_instructions"]
+        n_rubrics = self.pipeline_config["n_rubrics"]
+        generation_config = self.strong_model_config["generation_config"]
+
         processed_data = []
         not_processed_data = []
 
-        for index, data in enumerate(dataset):
-            output_dict = {}
-
-            task, skills = analyze_instructions(data,
-                                                self.strong_engine,
-                                                self.strong_model_config["generation_config"])
+        # Stage 1: extract the task and skills of the seed instructions
+        tasks, skills = analyze_instructions(seed_instructions, self.strong_engine, generation_config)
 
+        seeds = []
+        for index, seed_instruction, task, task_skills in zip(indices, seed_instructions, tasks, skills):
             if task is None:
                 not_processed_data.append(index)
                 continue
 
-            generated_instructions = generate_instructions(self.pipeline_config["n_instructions"],
-                                                           task,
-                                                           skills,
-                                                           self.strong_engine,
-                                                           self.strong_model_config["generation_config"])
-
-            rubrics, actions = generate_actions(self.pipeline_config["n_rubrics"],
-                                                task,
-                                                skills,
-                                                self.strong_engine,
-                                                self.strong_model_config["generation_config"])
+            seeds.append(SeedState(index=index, seed_instruction=seed_instruction, task=task, skills=task_skills))
+
+        # Stage 2: generate the simple instructions, rubrics and actions of the remaining seeds
+        generated_instructions = generate_instructions(n_instructions,
+                                                       [seed.task for seed in seeds],
+                                                       [seed.skills for seed in seeds],
+                                                       self.strong_engine,
+                                                       generation_config)
+
+        rubrics, actions = generate_actions(n_rubrics,
+                                            [seed.task for seed in seeds],
+                                            [seed.skills for seed in seeds],
+                                            self.strong_engine,
+                                            generation_config)
+
+        valid_seeds = []
+        for seed, seed_generated_instructions, seed_rubrics, seed_actions in zip(seeds, generated_instructions, rubrics, actions):
+            if (not seed_generated_instructions or seed_actions is None
+                    or len(seed_rubrics) != len(seed_actions) or len(seed_rubrics) < n_rubrics):
+                not_processed_data.append(seed.index)
+                continue
 
-            if actions is None or len(rubrics) != len(actions) or len(rubrics) < self.pipeline_config["n_rubrics"]:
-                not_processed_data.append(index)
+            seed.rubrics = seed_rubrics[:n_rubrics]
+            seed.actions = seed_actions[:n_rubrics]
+            seed.generated_instructions = seed_generated_instructions[:n_instructions]
+            seed.sampled_rubrics, seed.sampled_actions, _ = sample_random_action_and_rubric(seed.rubrics,
+                                                                                            seed.actions,
+                                                                                            n_instructions=len(seed.generated_instructions))
+            valid_seeds.append(seed)
+
+        # Stage 3: improve and answer the instructions of all the seeds as one flat list
+        flat_instructions = []
+        flat_actions = []
+        for seed in valid_seeds:
+            seed.offset = len(flat_instructions)
+            flat_instructions.extend(seed.generated_instructions)
+            flat_actions.extend(seed.sampled_actions)
+
+        improved_instructions = improve_instructions(flat_instructions,
+                                                     flat_actions,
+                                                     self.strong_engine,
+                                                     generation_config)
+
+        target_answers, strong_answers = self.answer_instructions(improved_instructions)
+
+        # Stage 4: score the improved instructions of all the seeds at once, the failed scorings have a nan margin
+        target_scores, strong_scores = self.score_answers(improved_instructions, target_answers, strong_answers)
+        margins = np.abs(np.asarray(strong_scores, dtype=float) - np.asarray(target_scores, dtype=float))
+
+        # Stage 5: refine the improved instructions of each seed
+        for seed in valid_seeds:
+            seed_slice = slice(seed.offset, seed.offset + len(seed.generated_instructions))
+            seed_improved_instructions = improved_instructions[seed_slice]
+            seed_strong_answers = strong_answers[seed_slice]
+            seed_target_answers = target_answers[seed_slice]
+
+            # No refinement is spent on a seed that is skipped anyway
+            if np.isnan(margins[seed_slice]).any():
+                not_processed_data.append(seed.index)
                 continue
 
-            if len(rubrics) > self.pipeline_config["n_rubrics"]:
-                rubrics = rubrics[:self.pipeline_config["n_rubrics"]]
-                actions = actions[:self.pipeline_config["n_rubrics"]]
-
-            if len(generated_instructions) > self.pipeline_config["n_instructions"]:
-                generated_instructions = generated_instructions[:self.pipeline_config["n_instructions"]]
-
-            sampled_rubrics, sampled_actions, _ = sample_random_action_and_rubric(rubrics,
-                                                                                  actions,
-                                                                                  n_instructions=len(generated_instructions))
-            improved_instructions = improve_instructions(generated_instructions,
-                                                         sampled_actions,
-                                                         self.strong_engine,
-                                                         self.strong_model_config["generation_config"])
-
-            output_dict["instruction_index"] = index
-            output_dict["seed_instruction"] = data
-            output_dict["task"] = task
-            output_dict["skills"] = skills
-            output_dict["rubrics"] = rubrics
-            output_dict["actions"] = actions
-            output_dict["simple_instructions"] = generated_instructions
+            output_dict = {}
+            output_dict["instruction_index"] = seed.index
+            output_dict["seed_instruction"] = seed.seed_instruction
+            output_dict["task"] = seed.task
+            output_dict["skills"] = seed.skills
+            output_dict["rubrics"] = seed.rubrics
+            output_dict["actions"] = seed.actions
+            output_dict["simple_instructions"] = seed.generated_instructions
             output_dict["strong_model"] = self.strong_model_name
             output_dict["target_model"] = self.target_model_name
             output_dict["improved_instructions"] = []
 
-            target_answers = instruction_answer(improved_instructions,
-                                                self.target_engine,
-                                                self.target_model_config["generation_config"])
-            strong_answers = instruction_answer(improved_instructions,
-                                                self.strong_engine,
-                                                self.strong_model_config["generation_config"])
-
-            for idx, (instruction, strong_answer, target_answer) in enumerate(zip(improved_instructions,
-                                                                                  strong_answers,
-                                                                                  target_answers)):
-                target_score, strong_score = contrastive_filtering(instruction,
-                                                                   target_answer,
-                                                                   strong_answer,
-                                                                   self.strong_engine,
-                                                                   self.strong_model_config["generation_config"])
-                if target_score is None or strong_score is None:
-                    not_processed_data.append(index)
-                    continue
-
-                margin = abs(strong_score - target_score)
+            for idx, instruction in enumerate(seed_improved_instructions):
+                strong_answer = seed_strong_answers[idx]
+                target_answer = seed_target_answers[idx]
+                strong_score = strong_scores[seed.offset + idx]
+                target_score = target_scores[seed.offset + idx]
 
                 improvement_dict = self.build_improvement_dict(iteration=0,
-                                                               original_instruction=generated_instructions[idx],
-                                                               action=sampled_actions[idx],
-                                                               rubric=sampled_rubrics[idx],
+                                                               original_instruction=seed.generated_instructions[idx],
+                                                               action=seed.sampled_actions[idx],
+                                                               rubric=seed.sampled_rubrics[idx],
                                                                improved_instruction=instruction,
                                                                strong_answer=strong_answer,
                                                                target_answer=target_answer,
@@ -289,38 +498,157 @@ class CodecLMPipeline(AbstractPipeline):
                                                                target_score=target_score)
                 improvement_trace = [improvement_dict]
                 c_improvement_trace = self.iterative_contrastive_filtering(instruction=instruction,
-                                                                           actions=actions,
-                                                                           rubrics=rubrics,
-                                                                           margin=margin)
+                                                                           actions=seed.actions,
+                                                                           rubrics=seed.rubrics,
+                                                                           margin=float(margins[seed.offset + idx]))
                 if c_improvement_trace is not None:
                     improvement_trace.extend(c_improvement_trace)
 
-                if len(improvement_trace) == 0:
-                    not_processed_data.append(index)
-                    continue
-
                 improved_instruction_dict = improvement_trace[-1]
 
                 if len(improvement_trace) > 1:
-                    improved_instruction_dict["improvement_history"] = improvement_trace[:-1]
+                    improved_instruction_dict.improvement_history = improvement_trace[:-1]
 
                 output_dict["improved_instructions"].append(improved_instruction_dict)
 
             processed_data.append(output_dict)
 
-            if progress_queue:
-                progress_queue.put(1)
+        return processed_data, not_processed_data
+
+    def resume_from_checkpoints(self, dataset: List[str], process_id: Optional[int] = None) -> Tuple[Set[int], List[int]]:
+        """
+        Load the checkpoints of a previous run and rewrite them with only the results that are kept.
+
+        The skipped seeds of the previous run are not in the processed checkpoint, so they are retried
+        and their skipped data is discarded. A possibly truncated last line is dropped.
 
-            process_id = process_id if process_id is not None else "0"
-            temp_processed_filename = f"_temp_processed_data_{process_id}.json"
-            temp_skipped_filename = f"_temp_skipped_data_{process_id}.json"
+        Args:
+            dataset (List[str]): The dataset the pipeline is run on.
+            process_id (Optional[int], optional): The process id. Defaults to None.
+
+        Returns:
+            Tuple[Set[int], List[int]]: The indices of the seeds already processed, and the kept not processed data.
+        """
+        processed_data = load_checkpoint(self.temp_file_path("processed_data", process_id))
+
+        # The indices are relative to the chunk, so a checkpoint of another dataset or chunking must not be resumed
+        for data in processed_data:
+            index = data["instruction_index"]
+            if index >= len(dataset) or data["seed_instruction"] != dataset[index]:
+                raise ValueError(f"The checkpoint {self.temp_file_path('processed_data', process_id)} does not match "
+                                 f"the seed instruction {index} of the dataset, it was written by another run. "
+                                 "Remove the temp files or rerun with the same dataset and number of processes.")
+
+        done = {data["instruction_index"] for data in processed_data}
+        not_processed_data = []
 
-            save_json(os.path.join(self.pipeline_config["output_path"], temp_processed_filename), processed_data)
-            save_json(os.path.join(self.pipeline_config["output_path"], temp_skipped_filename), not_processed_data)
+        save_jsonl(self.temp_file_path("processed_data", process_id), processed_data)
+        save_jsonl(self.temp_file_path("skipped_data", process_id), not_processed_data)
 
-        generated_dataset = build_final_dataset(processed_data,
+        return done, not_processed_data
+
+    def iter_processed_data(self, process_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Lazily read the processed data from the checkpoint.
+
+        Args:
+            process_id (Optional[int], optional): The process id. Defaults to None.
+
+        Returns:
+            Iterator[Dict[str, Any]]: The processed data, with the improved instructions as `ImprovementRecord`s.
+        """
+        for data in iter_jsonl(self.temp_file_path("processed_data", process_id)):
+            data["improved_instructions"] = [ImprovementRecord.from_dict(record) for record in data["improved_instructions"]]
+            yield data
+
+    def run_pipeline(self,
+                     dataset: List[str],
+                     progress_callback: Optional[Callable[[int], None]] = None,
+                     process_id: Optional[int] = None,
+                     stop_event: Optional[Event] = None) -> Tuple[Optional[Iterator[Dict[str, str]]], str, List[int]]:
+        """
+        Run the pipeline on the dataset.
+
+        The dataset is processed in mini-batches of `batch_size` seed instructions, see `process_batch`,
+        and `concurrency` mini-batches are processed at the same time. The results are collected in completion order
+        and appended to the `_temp_processed_data_{process_id}.jsonl` and `_temp_skipped_data_{process_id}.jsonl` checkpoints.
+        The seeds already processed in these checkpoints by a previous run are not processed again.
+
+        The processed data is only kept on disk, and the final dataset is built lazily from it.
+        When interrupted, the final dataset is not built and the run can be resumed from the checkpoints.
+
+        Args:
+            dataset (List[str]): The dataset to run the pipeline on.
+            progress_callback (Optional[Callable[[int], None]], optional): Called with the number of newly processed data points. Defaults to None.
+            process_id (Optional[int], optional): The process id. Defaults to None.
+            stop_event (Optional[Event], optional): When set, no new mini-batch is started. Defaults to None.
+
+        Returns:
+            Tuple[Optional[Iterator[Dict[str, str]]], str, List[int]]: The final dataset (None when interrupted),
+                the path of the processed data, and the not processed data.
+        """
+        batch_size = self.pipeline_config.get("batch_size") or 8
+        concurrency = self.pipeline_config.get("concurrency") or 1
+
+        done, not_processed_data = self.resume_from_checkpoints(dataset, process_id)
+
+        if progress_callback and done:
+            progress_callback(len(done))
+
+        batch_starts = iter(range(0, len(dataset), batch_size))
+
+        # Each mini-batch only appends its own results to the checkpoints
+        with open(self.temp_file_path("processed_data", process_id), "ab") as temp_processed_file, \
+             open(self.temp_file_path("skipped_data", process_id), "ab") as temp_skipped_file, \
+             concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # The mini-batches are I/O bound on the engines, so threads are enough to keep several of them in flight
+            running_batches = {}
+
+            while True:
+                # Only `concurrency` mini-batches are submitted at a time, so an interrupt only waits for the running ones
+                while len(running_batches) < concurrency and not (stop_event is not None and stop_event.is_set()):
+                    start = next(batch_starts, None)
+                    if start is None:
+                        break
+
+                    indices = [index for index in range(start, min(start + batch_size, len(dataset))) if index not in done]
+                    if not indices:
+                        continue
+
+                    future = executor.submit(self.process_batch, indices, [dataset[index] for index in indices])
+                    running_batches[future] = len(indices)
+
+                if not running_batches:
+                    break
+
+                finished_batches, _ = concurrent.futures.wait(running_batches, return_when=concurrent.futures.FIRST_COMPLETED)
+
+                for future in finished_batches:
+                    batch_processed_data, batch_not_processed_data = future.result()
+
+                    not_processed_data.extend(batch_not_processed_data)
+
+                    append_jsonl(temp_processed_file, batch_processed_data)
+                    append_jsonl(temp_skipped_file, batch_not_processed_data)
+
+                    n_batch_seeds = running_batches.pop(future)
+                    if progress_callback:
+                        progress_callback(n_batch_seeds)
+
+        # After an interrupt only the checkpoints are kept, so the processed data is not judged
+        if stop_event is not None and stop_event.is_set():
+            return None, self.temp_file_path("processed_data", process_id), not_processed_data
+
+        generated_dataset = build_final_dataset(self.iter_processed_data(process_id),
                                                 judge_model_name=self.judge_model_name,
                                                 judge_engine=self.judge_engine,
-                                                judge_model_config=self.judge_model_config)
+                                                judge_model_config=self.judge_model_config,
+                                                judge_batch_size=self.pipeline_config.get("judge_batch_size") or 256)
+
+        return generated_dataset, self.temp_file_path("processed_data", process_id), not_processed_data
+
 
-        return generated_dataset, processed_data, not_processed_data
+# The pipelines selectable from the command line with `--pipeline`
+PIPELINES = {
+    "codec_lm": CodecLMPipeline,
+}
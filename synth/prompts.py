@@ -1,4 +1,8 @@
-INSTRUCTION_ANALYZER = """I want you to act as an instruction analyzer.
+import keyword
+import string
+from typing import Any, Callable, Dict
+
+INSTRUCTION_ANALYZER_STATIC_PREFIX = """I want you to act as an instruction analyzer.
 Given an instruction, you should recognize its use case and the skills (or knowledge) required for a large language model (LLM) to answer the question.
 Generate the use case and skills required without any explanation.
 List at most 3 skills, each skill must be transferable, so that LLM can leverage them to answer similar questions.
@@ -20,7 +24,9 @@ The method section of your paper is too brief and does not explain how your prop
 Task: general knowledge question answering
 Skills: academic writing, machine learning
 
-{instruction}"""
+"""
+INSTRUCTION_ANALYZER_DYNAMIC_TAIL = """{instruction}"""
+INSTRUCTION_ANALYZER = INSTRUCTION_ANALYZER_STATIC_PREFIX + INSTRUCTION_ANALYZER_DYNAMIC_TAIL
 
 
 INSTRUCTION_WRITER = """I want you to act as an instruction writer.
@@ -95,17 +101,19 @@ Action: <action>
 Generate the domain-specific rubric and the corresponding action without any explanation in a numbered bullet point:"""
 
 
-INSTRUCTION_IMPROVER = """I want you to act as an instruction improver with domain expertise.
+INSTRUCTION_IMPROVER_STATIC_PREFIX = """I want you to act as an instruction improver with domain expertise.
 Your job is to make the given instruction more challenging by following the provided improving action item. The generated instruction must be reasonable, self-consistent, and self-contained.
 Ensure that all necessary information and context from the original instruction are retained.
 Do not directly copy words or phrases from the action.
 
 Output only the improved instruction without any explanation or additional information.
 
-Improving action: {action}
+"""
+INSTRUCTION_IMPROVER_DYNAMIC_TAIL = """Improving action: {action}
 Input instruction: {input_instruction}
 
 Improved instruction:"""
+INSTRUCTION_IMPROVER = INSTRUCTION_IMPROVER_STATIC_PREFIX + INSTRUCTION_IMPROVER_DYNAMIC_TAIL
 
 
 CONTRASTIVE_FILTERING = """You are a helpful and precise assistant for checking the quality of the answer.
@@ -138,7 +146,7 @@ Action: <action_content>
 Here is the text: {text}"""
 
 
-INSTRUCTION_ANSWER_REWARD = """Review the user’s question and the corresponding response using the additive 5-point scoring system described below. Points are accumulated based on the satisfaction of each criterion:
+INSTRUCTION_ANSWER_REWARD_STATIC_PREFIX = """Review the user’s question and the corresponding response using the additive 5-point scoring system described below. Points are accumulated based on the satisfaction of each criterion:
 
 - Add 1 point if the response is relevant and provides some information related to the user’s inquiry, even if it is incomplete or contains some irrelevant content.
 - Add another point if the response addresses a substantial portion of the user’s question, but does not completely resolve the query or provide a direct answer.
@@ -146,7 +154,8 @@ INSTRUCTION_ANSWER_REWARD = """Review the user’s question and the correspondin
 - Grant a fourth point if the response is clearly written from an AI Assistant’s perspective, addressing the user’s question directly and comprehensively, and is well-organized and helpful, even if there is slight room for improvement in clarity, conciseness or focus.
 - Bestow a fifth point for a response that is impeccably tailored to the user’s question by an AI Assistant, without extraneous information, reflecting expert knowledge, and demonstrating a high-quality, engaging, and insightful answer.
 
-User: {instruction}
+"""
+INSTRUCTION_ANSWER_REWARD_DYNAMIC_TAIL = """User: {instruction}
 
 <response>{answer}</response>
 
@@ -156,3 +165,65 @@ After examining the user’s instruction and the response:
 - Conclude with the score using the format: “Score: <total points>”
 
 Remember to assess from the AI Assistant perspective, utilizing web search knowledge as necessary. To evaluate the response in alignment with this additive scoring model, we’ll systematically attribute points based on the outlined criteria."""
+INSTRUCTION_ANSWER_REWARD = INSTRUCTION_ANSWER_REWARD_STATIC_PREFIX + INSTRUCTION_ANSWER_REWARD_DYNAMIC_TAIL
+
+
+# The static prefixes of the prompts sent for every instruction, which the engines can mark for prompt caching
+CACHEABLE_PROMPT_PREFIXES = (INSTRUCTION_ANALYZER_STATIC_PREFIX,
+                             INSTRUCTION_IMPROVER_STATIC_PREFIX,
+                             INSTRUCTION_ANSWER_REWARD_STATIC_PREFIX)
+
+
+def _compile(template: str) -> Callable[..., str]:
+    """
+    Compile a prompt template into a function rendering it.
+
+    The template is parsed once, and the source of a function concatenating its literals and fields
+    is generated and compiled, so rendering does no parsing nor lookups.
+    Only plain `{field}` replacement fields are supported.
+
+    Args:
+        template (str): The prompt template.
+
+    Returns:
+        Callable[..., str]: A function rendering the template from the keyword arguments of its fields.
+
+    Raises:
+        ValueError: If a replacement field is not a plain `{field}`, e.g. a positional or indexed field,
+            or a field with a conversion or a format spec.
+    """
+    fields = []
+    parts = []
+    for literal, field, format_spec, conversion in string.Formatter().parse(template):
+        if literal:
+            parts.append(repr(literal))
+
+        if field is not None:
+            if not field.isidentifier() or keyword.iskeyword(field) or format_spec or conversion is not None:
+                raise ValueError(f"Unsupported replacement field in the prompt template: {field!r}, "
+                                 f"conversion {conversion!r}, format spec {format_spec!r}. Only plain {{field}} fields are supported.")
+
+            parts.append(f"str({field})")
+
+            if field not in fields:
+                fields.append(field)
+
+    # Keyword-only parameters, a template without fields renders to itself
+    signature = f"*, {', '.join(fields)}" if fields else ""
+    source = f"def render({signature}):\n    return ''.join(({', '.join(parts)},))\n"
+
+    namespace: Dict[str, Any] = {}
+    exec(compile(source, f"<prompt template {template[:30]!r}>", "exec"), namespace)
+
+    return namespace["render"]
+
+
+render_instruction_analyzer = _compile(INSTRUCTION_ANALYZER)
+render_instruction_writer = _compile(INSTRUCTION_WRITER)
+render_single_instruction_writer = _compile(SINGLE_INSTRUCTION_WRITER)
+render_actions_generator = _compile(ACTIONS_GENERATOR)
+render_single_action_generator = _compile(SINGLE_ACTION_GENERATOR)
+render_instruction_improver = _compile(INSTRUCTION_IMPROVER)
+render_contrastive_filtering = _compile(CONTRASTIVE_FILTERING)
+render_rubric_and_action_extraction_prompt = _compile(RUBRIC_AND_ACTION_EXTRACTION_PROMPT)
+render_instruction_answer_reward = _compile(INSTRUCTION_ANSWER_REWARD)
@@ -1,116 +1,155 @@
-from typing import Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future
+from itertools import islice
+from typing import (Deque, Dict, Iterable, Iterator, List, Optional, Tuple,
+                    Union)
 
 from synth.engines.abstract_engine import AbstactEngine
 from synth.utils.text_utils import (extract_digits, extract_instructions,
                                     extract_reasoning_and_score,
                                     extract_rubric_action, extract_task_skills)
 
-from .prompts import (ACTIONS_GENERATOR, CONTRASTIVE_FILTERING,
-                      INSTRUCTION_ANALYZER, INSTRUCTION_ANSWER_REWARD,
-                      INSTRUCTION_IMPROVER, INSTRUCTION_WRITER,
-                      RUBRIC_AND_ACTION_EXTRACTION_PROMPT,
-                      SINGLE_ACTION_GENERATOR, SINGLE_INSTRUCTION_WRITER)
+from .prompts import (render_actions_generator, render_contrastive_filtering,
+                      render_instruction_analyzer,
+                      render_instruction_answer_reward,
+                      render_instruction_improver, render_instruction_writer,
+                      render_rubric_and_action_extraction_prompt,
+                      render_single_action_generator,
+                      render_single_instruction_writer)
 
 
-def analyze_instructions(instruction: str,
+def _as_list(value: Union[str, List[str]]) -> List[str]:
+    """
+    Wrap a single string in a list.
+
+    Args:
+        value (Union[str, List[str]]): A string or a list of strings.
+
+    Returns:
+        List[str]: The list of strings.
+    """
+    return value if isinstance(value, list) else [value]
+
+
+def analyze_instructions(instructions: List[str],
                          engine: AbstactEngine,
-                         generation_config: dict) -> List[dict]:
+                         generation_config: dict) -> Tuple[List[Optional[str]], List[Optional[str]]]:
     """
-    Analyze an instruction to extract the task and skills.
+    Analyze a list of instructions to extract their task and skills.
 
     Args:
-        instruction (str): The instruction to analyze.
+        instructions (List[str]): The instructions to analyze.
         engine (AbstactEngine): The engine to use for generation.
         generation_config (dict): The configuration for the generation engine.
 
     Returns:
-        List[dict]: A list of dictionaries containing the task and skills for each instruction.
+        Tuple[List[Optional[str]], List[Optional[str]]]: The task and skills of each instruction, None when they could not be extracted.
     """
-    instruction = INSTRUCTION_ANALYZER.format(instruction=instruction)
-    analyzed_instruction = engine([instruction], **generation_config)
+    instructions = [render_instruction_analyzer(instruction=instruction) for instruction in instructions]
+    analyzed_instructions = engine(instructions, **generation_config)
+
+    tasks_and_skills = [extract_task_skills(analyzed_instruction) for analyzed_instruction in analyzed_instructions]
 
-    return extract_task_skills(analyzed_instruction[0])
+    return [task for task, _ in tasks_and_skills], [skills for _, skills in tasks_and_skills]
 
 
 def generate_instructions(number_of_instructions: int,
-                          use_case: str,
-                          skills: str,
+                          use_cases: List[str],
+                          skills: List[str],
                           engine: AbstactEngine,
-                          generation_config: dict) -> List[str]:
+                          generation_config: dict) -> List[List[str]]:
     """
-    Generate instructions for a given use case and skills.
+    Generate instructions for each pair of use case and skills.
 
     Args:
-        number_of_instructions (int): The number of instructions to generate.
-        use_case (str): The use case for the instructions.
-        skills (str): The skills required for the instructions.
+        number_of_instructions (int): The number of instructions to generate for each use case.
+        use_cases (List[str]): The use cases for the instructions.
+        skills (List[str]): The skills required for the instructions of each use case.
         engine (AbstactEngine): The engine to use for generation.
         generation_config (dict): The configuration for the generation engine.
 
     Returns:
-        List[str]: A list of generated instructions.
+        List[List[str]]: The generated instructions for each use case.
     """
     if number_of_instructions > 1:
-        instructions = INSTRUCTION_WRITER.format(number_of_instructions=number_of_instructions,
-                                                 use_case=use_case,
-                                                 skills=skills)
+        instructions = [render_instruction_writer(number_of_instructions=number_of_instructions,
+                                                  use_case=use_case,
+                                                  skills=use_case_skills)
+                        for use_case, use_case_skills in zip(use_cases, skills)]
     else:
-        instructions = SINGLE_INSTRUCTION_WRITER.format(use_case=use_case, skills=skills)
+        instructions = [render_single_instruction_writer(use_case=use_case, skills=use_case_skills)
+                        for use_case, use_case_skills in zip(use_cases, skills)]
 
-    generated_instructions = engine([instructions], **generation_config)
+    generated_instructions = engine(instructions, **generation_config)
 
-    return extract_instructions(generated_instructions[0])
+    return [extract_instructions(generated_instruction) for generated_instruction in generated_instructions]
 
 
 def generate_actions(number_of_rubrics: int,
-                     use_case: str,
-                     skills: str,
+                     use_cases: List[str],
+                     skills: List[str],
                      engine: AbstactEngine,
-                     generation_config: dict) -> Tuple[List[str], List[str]]:
+                     generation_config: dict) -> Tuple[List[List[str]], List[List[str]]]:
     """
-    Generate actions for a given use case.
+    Generate rubrics and actions for each pair of use case and skills.
 
     Args:
-        number_of_actions (int): The number of actions to generate.
-        use_case (str): The use case for the actions.
+        number_of_rubrics (int): The number of rubrics to generate for each use case.
+        use_cases (List[str]): The use cases for the actions.
+        skills (List[str]): The skills required for each use case.
         engine (AbstactEngine): The engine to use for generation.
         generation_config (dict): The configuration for the generation engine.
 
     Returns:
-        Tuple[List[str], List[str]]: A tuple containing the rubrics and actions.
+        Tuple[List[List[str]], List[List[str]]]: The rubrics and the actions for each use case.
     """
     if number_of_rubrics > 1:
-        instructions = ACTIONS_GENERATOR.format(number_of_rubrics=number_of_rubrics,
-                                                use_case=use_case,
-                                                skills=skills)
+        instructions = [render_actions_generator(number_of_rubrics=number_of_rubrics,
+                                                 use_case=use_case,
+                                                 skills=use_case_skills)
+                        for use_case, use_case_skills in zip(use_cases, skills)]
     else:
-        instructions = SINGLE_ACTION_GENERATOR.format(use_case=use_case, skills=skills)
+        instructions = [render_single_action_generator(use_case=use_case, skills=use_case_skills)
+                        for use_case, use_case_skills in zip(use_cases, skills)]
+
+    generated_actions = engine(instructions, **generation_config)
+
+    rubrics_and_actions = [extract_rubric_action(generated_action) for generated_action in generated_actions]
 
-    generated_actions = engine([instructions],
-                               **generation_config)
+    # Ask the engine to extract the rubrics and actions from the outputs that could not be parsed, the failed requests have no output
+    retry_indices = [idx for idx, (rubrics, actions) in enumerate(rubrics_and_actions)
+                     if (not rubrics or not actions) and generated_actions[idx] is not None]
 
-    rubrics, actions = extract_rubric_action(generated_actions[0])
+    if retry_indices:
+        instructions = [render_rubric_and_action_extraction_prompt(text=generated_actions[idx]) for idx in retry_indices]
+        extracted_actions = engine(instructions, **generation_config)
 
-    if not rubrics or not actions:
-        instructions = RUBRIC_AND_ACTION_EXTRACTION_PROMPT.format(text=generated_actions[0])
-        generated_actions = engine([instructions], **generation_config)
+        for idx, extracted_action in zip(retry_indices, extracted_actions):
+            rubrics_and_actions[idx] = extract_rubric_action(extracted_action)
 
-        rubrics, actions = extract_rubric_action(generated_actions[0])
+    all_rubrics = []
+    all_actions = []
 
-    if number_of_rubrics == 1 and len(rubrics) > 1:
-        rubrics = rubrics[0]
-        actions = actions[0]
+    for rubrics, actions in rubrics_and_actions:
+        if number_of_rubrics == 1 and len(rubrics) > 1:
+            rubrics = rubrics[0]
+            actions = actions[0]
 
-    return rubrics, actions
+        all_rubrics.append(rubrics)
+        all_actions.append(actions)
+
+    return all_rubrics, all_actions
 
 
 def improve_instructions(instructions: List[str],
                          actions: List[str],
                          engine: AbstactEngine,
-                         generation_config: dict) -> List[str]:
+                         generation_config: dict) -> List[Optional[str]]:
     """
     Improve a list of instructions by following a given action.
 
+    Identical (instruction, action) pairs are sent to the engine only once.
+
     Args:
         Instructions (List[str]): The instruction to improve.
         actions (List[str]): The action to improve the instruction.
@@ -118,152 +157,260 @@ def improve_instructions(instructions: List[str],
         generation_config (dict): The configuration for the generation engine.
 
     Returns:
-        List[str]
+        List[Optional[str]]: The improved instructions, None for the failed requests.
+    """
+    pairs = list(zip(_as_list(instructions), _as_list(actions), strict=True))
+    unique_pairs = list(dict.fromkeys(pairs))
+
+    outputs = engine([render_instruction_improver(input_instruction=instruction, action=action)
+                      for instruction, action in unique_pairs],
+                     **generation_config)
+    improved_instructions = {pair: output.strip() if output is not None else None for pair, output in zip(unique_pairs, outputs)}
+
+    return [improved_instructions[pair] for pair in pairs]
+
+
+def instruction_answer(instructions: Union[str, List[str]], engine: AbstactEngine, generation_config: dict) -> List[str]:
+    """
+    Generate the answers to an instruction or a list of instructions.
+
+    Identical instructions are sent to the engine only once.
+
+    Args:
+        instructions (Union[str, List[str]]): The instruction or the instructions to answer.
+        engine (AbstactEngine): The engine to use for generation.
+        generation_config (dict): The configuration for the generation engine.
+
+    Returns:
+        List[str]: The answers, in the same order as the instructions.
     """
-    instructions = [instructions] if isinstance(instructions, str) else instructions
-    actions = [actions] if isinstance(actions, str) else actions
+    instructions = _as_list(instructions)
 
-    instructions = [INSTRUCTION_IMPROVER.format(input_instruction=instruction, action=action)
-                    for instruction, action in zip(instructions, actions)]
-    instructions = engine(instructions, **generation_config)
-    instructions = [i.strip() for i in instructions]
+    unique_instructions = list(dict.fromkeys(instructions))
+    answers = dict(zip(unique_instructions, engine(unique_instructions, **generation_config)))
 
-    return instructions
+    return [answers[instruction] for instruction in instructions]
 
 
-def instruction_answer(instructions: str, engine: AbstactEngine, generation_config: dict) -> str:
+async def ainstruction_answer(instructions: List[str], engine: AbstactEngine, generation_config: dict) -> List[str]:
     """
-    Generate an answer to a given instruction.
+    Generate the answers to a list of instructions, asynchronously.
+
+    Identical instructions are sent to the engine only once.
 
     Args:
-        instruction (str): The instruction to answer.
+        instructions (List[str]): The instructions to answer.
         engine (AbstactEngine): The engine to use for generation.
         generation_config (dict): The configuration for the generation engine.
 
     Returns:
-        str: The answer to the instruction.
+        List[str]: The answers to the instructions.
     """
-    instructions = instructions if isinstance(instructions, list) else [instructions]
-    answers = engine(instructions, **generation_config)
+    instructions = _as_list(instructions)
+
+    unique_instructions = list(dict.fromkeys(instructions))
+    answers = dict(zip(unique_instructions, await engine.acall(unique_instructions, **generation_config)))
 
-    return answers
+    return [answers[instruction] for instruction in instructions]
 
 
-def contrastive_filtering(instruction: str,
-                          target_model_answer: str,
-                          strong_model_answer: str,
+def contrastive_filtering(instructions: List[str],
+                          target_model_answers: List[str],
+                          strong_model_answers: List[str],
                           engine: AbstactEngine,
-                          generation_config: dict) -> Tuple[int, int]:
+                          generation_config: dict,
+                          short_circuit: bool = False) -> Tuple[List[Optional[float]], List[Optional[float]]]:
     """
-    Filter out instructions that are not contrastive.
+    Score the target and strong answers to a list of instructions, to filter out the instructions that are not contrastive.
 
     Args:
-        instructions (List[str]): A list of instructions to filter.
+        instructions (List[str]): The instructions.
+        target_model_answers (List[str]): The answers of the target model.
+        strong_model_answers (List[str]): The answers of the strong model.
         engine (AbstactEngine): The engine to use for generation.
         generation_config (dict): The configuration for the generation engine.
+        short_circuit (bool, optional): Whether to score the second order of the answers with a second call, only for the
+            answers whose first order could be scored. Defaults to False.
 
     Returns:
-        Tuple[int, int]: The scores for the two answers.
+        Tuple[List[Optional[float]], List[Optional[float]]]: The target and strong scores, None when the answers could not be scored.
     """
-    contrastive_instructions = engine([CONTRASTIVE_FILTERING.format(instruction=instruction,
-                                                                    answer_1=target_model_answer,
-                                                                    answer_2=strong_model_answer)],
-                                      **generation_config)
-    target_score1, strong_score1 = extract_digits(contrastive_instructions[0])
+    # Both orders of the answers are scored to mitigate the effect of the order
+    first_order_prompts = []
+    second_order_prompts = []
+    for instruction, target_model_answer, strong_model_answer in zip(instructions, target_model_answers, strong_model_answers):
+        first_order_prompts.append(render_contrastive_filtering(instruction=instruction,
+                                                                answer_1=target_model_answer,
+                                                                answer_2=strong_model_answer))
+        second_order_prompts.append(render_contrastive_filtering(instruction=instruction,
+                                                                 answer_1=strong_model_answer,
+                                                                 answer_2=target_model_answer))
+
+    if short_circuit:
+        first_order_scores = [extract_digits(output) for output in engine(first_order_prompts, **generation_config)]
+
+        # The second order is only useful when the first one could be scored
+        scored = [idx for idx, (target_score, strong_score) in enumerate(first_order_scores)
+                  if target_score is not None and strong_score is not None]
+
+        second_order_scores: List[Tuple[Optional[int], Optional[int]]] = [(None, None)] * len(instructions)
+        if scored:
+            contrastive_instructions = engine([second_order_prompts[idx] for idx in scored], **generation_config)
+
+            for idx, output in zip(scored, contrastive_instructions):
+                second_order_scores[idx] = extract_digits(output)
+    else:
+        # One call for both orders, so the engine can batch them together
+        contrastive_instructions = engine([prompt for prompts in zip(first_order_prompts, second_order_prompts) for prompt in prompts],
+                                          **generation_config)
+        first_order_scores = [extract_digits(output) for output in contrastive_instructions[0::2]]
+        second_order_scores = [extract_digits(output) for output in contrastive_instructions[1::2]]
+
+    target_scores = []
+    strong_scores = []
+    for (target_score1, strong_score1), (strong_score2, target_score2) in zip(first_order_scores, second_order_scores):
+        if target_score1 is None or target_score2 is None or strong_score1 is None or strong_score2 is None:
+            target_scores.append(None)
+            strong_scores.append(None)
+            continue
 
-    # We do this to mitigate the effect of the order of the answers
-    contrastive_instructions = engine([CONTRASTIVE_FILTERING.format(instruction=instruction,
-                                                                    answer_1=strong_model_answer,
-                                                                    answer_2=target_model_answer)],
-                                      **generation_config)
-    strong_score2, target_score2 = extract_digits(contrastive_instructions[0])
+        target_scores.append((target_score1 + target_score2) / 2)
+        strong_scores.append((strong_score1 + strong_score2) / 2)
 
-    if target_score1 is None or target_score2 is None or strong_score1 is None or strong_score2 is None:
-        return None, None
+    return target_scores, strong_scores
 
-    target_score = (target_score1 + target_score2) / 2
-    strong_score = (strong_score1 + strong_score2) / 2
 
-    return target_score, strong_score
+def build_judge_prompts(pairs: List[Tuple[str, str]]) -> List[str]:
+    """
+    Build the judge prompts of a list of instructions and their answers.
 
+    Args:
+        pairs (List[Tuple[str, str]]): The instructions and their answers.
 
-def rank_instruction_with_judge(instruction: str,
-                                answer: str,
-                                engine: AbstactEngine,
-                                generation_config: dict) -> Tuple[str, float]:
+    Returns:
+        List[str]: The judge prompts.
     """
-    Generate the final instructions and judge them.
+    return [render_instruction_answer_reward(instruction=instruction, answer=answer) for instruction, answer in pairs]
+
+
+def parse_judge_outputs(outputs: List[str]) -> List[Tuple[Optional[str], Optional[float]]]:
+    """
+    Parse the judge outputs into the reasoning and score of each instruction.
 
     Args:
-        instruction (str): The instruction to generate.
-        answer (str): The answer to the instruction.
-        engine (AbstactEngine): The engine to use for generation.
-        generation_config (dict): The configuration for the generation engine.
+        outputs (List[str]): The outputs of the judge model.
 
     Returns:
-        Tuple[str, float]: The final instruction and its score.
+        List[Tuple[Optional[str], Optional[float]]]: The reasoning and score of each instruction, None when they could not be extracted.
     """
-    instruction = engine([INSTRUCTION_ANSWER_REWARD.format(instruction=instruction, answer=answer)],
-                         **generation_config)
-    reasoning, score = extract_reasoning_and_score(instruction[0])
+    judgements = []
+    for output in outputs:
+        reasoning, score = extract_reasoning_and_score(output)
 
-    if reasoning is None or score is None:
-        return None, None
+        if reasoning is None or score is None:
+            judgements.append((None, None))
+        else:
+            judgements.append((reasoning, score))
 
-    return reasoning, score
+    return judgements
 
 
-def build_final_dataset(all_generated_data: dict,
+def build_final_dataset(all_generated_data: Iterable[dict],
                         judge_model_name: Optional[str],
                         judge_engine: Optional[AbstactEngine] = None,
-                        judge_model_config: Optional[dict] = None) -> List[Dict[str, str]]:
+                        judge_model_config: Optional[dict] = None,
+                        judge_batch_size: int = 256) -> Iterator[Dict[str, str]]:
     """
-    Build the final instruction dataset.
+    Build the final instruction dataset, one data point at a time.
+
+    The data points are judged `judge_batch_size` at a time, with one call to the judge engine.
+    The next window of data points is already being judged while the current one is yielded.
 
     Args:
-        all_generated_data (dict): The generated data.
+        all_generated_data (Iterable[dict]): The generated data, which can be read lazily.
         judge_model_name (Optional[str]): The name of the judge model.
         judge_engine (Optional[AbstactEngine], optional): The engine to use for the judge model. Defaults to None.
         judge_model_config (Optional[dict], optional): The configuration for the judge model. Defaults to None.
+        judge_batch_size (int, optional): The number of data points judged together. Defaults to 256.
 
     Returns:
-        List[Dict[str, str]]: The final instruction dataset.
+        Iterator[Dict[str, str]]: The final instruction dataset.
     """
-    final_instruction_dataset = []
+    output_dicts = _iter_output_dicts(all_generated_data)
+    windows = iter(lambda: list(islice(output_dicts, judge_batch_size)), [])
+
+    pending_windows: Deque[Tuple[list, Optional[Future]]] = deque()
+    for window in windows:
+        judge_outputs = None
+        if judge_engine is not None:
+            judge_outputs = judge_engine.submit(build_judge_prompts([(output_dict["instruction"], output_dict["answer"])
+                                                                     for output_dict, _ in window]),
+                                                **judge_model_config["generation_config"])
+
+        pending_windows.append((window, judge_outputs))
+
+        if len(pending_windows) > 1:
+            yield from _finish_window(*pending_windows.popleft(), judge_model_name=judge_model_name)
+
+    while pending_windows:
+        yield from _finish_window(*pending_windows.popleft(), judge_model_name=judge_model_name)
+
+
+def _finish_window(window: List[Tuple[Dict[str, str], dict]],
+                   judge_outputs: Optional[Future],
+                   judge_model_name: Optional[str]) -> Iterator[Dict[str, str]]:
+    """
+    Add the judgements and the topics to a window of data points.
+
+    Args:
+        window (List[Tuple[Dict[str, str], dict]]): The data points, with the generated data they come from.
+        judge_outputs (Optional[Future]): The future of the judge outputs of the data points, None without a judge model.
+        judge_model_name (Optional[str]): The name of the judge model.
 
+    Returns:
+        Iterator[Dict[str, str]]: The data points.
+    """
+    if judge_outputs is not None:
+        for (output_dict, _), (judge_reason, judge_score) in zip(window, parse_judge_outputs(judge_outputs.result())):
+            if judge_reason is not None:
+                output_dict["judge_instruction_score"] = judge_score
+                output_dict["judge_reason"] = judge_reason
+                output_dict["judge_model_name"] = judge_model_name
+
+    for output_dict, data in window:
+        output_dict["topic"] = data["task"]
+        output_dict["subtopic"] = data["skills"]
+
+        yield output_dict
+
+
+def _iter_output_dicts(all_generated_data: Iterable[dict]) -> Iterator[Tuple[Dict[str, str], dict]]:
+    """
+    Pick the best answer of each improved instruction, before it is judged.
+
+    Args:
+        all_generated_data (Iterable[dict]): The generated data, which can be read lazily.
+
+    Returns:
+        Iterator[Tuple[Dict[str, str], dict]]: The data points, with the generated data they come from.
+    """
     for data in all_generated_data:
         instructions = data["improved_instructions"]
 
         for instruction in instructions:
             output_dict = {}
-            output_dict["instruction"] = instruction["improved_instruction"]
+            output_dict["instruction"] = instruction.improved_instruction
 
-            strong_answer_score = instruction["strong_score"]
-            target_answer_score = instruction["target_score"]
+            strong_answer_score = instruction.strong_score
+            target_answer_score = instruction.target_score
 
             if strong_answer_score >= target_answer_score:
-                output_dict["answer"] = instruction["strong_answer"]
+                output_dict["answer"] = instruction.strong_answer
                 output_dict["model"] = data["strong_model"]
-                output_dict["contrastive_score"] = instruction["strong_score"]
+                output_dict["contrastive_score"] = instruction.strong_score
             else:
-                output_dict["answer"] = instruction["target_answer"]
+                output_dict["answer"] = instruction.target_answer
                 output_dict["model"] = data["target_model"]
-                output_dict["contrastive_score"] = instruction["target_score"]
-
-            if judge_engine is not None:
-                judge_reason, judge_score = rank_instruction_with_judge(instruction=output_dict["instruction"],
-                                                                        answer=output_dict["answer"],
-                                                                        engine=judge_engine,
-                                                                        generation_config=judge_model_config["generation_config"])
-
-                if judge_reason is not None:
-                    output_dict["judge_instruction_score"] = judge_score
-                    output_dict["judge_reason"] = judge_reason
-                    output_dict["judge_model_name"] = judge_model_name
-
-            output_dict["topic"] = data["task"]
-            output_dict["subtopic"] = data["skills"]
-
-            final_instruction_dataset.append(output_dict)
+                output_dict["contrastive_score"] = instruction.target_score
 
-    return final_instruction_dataset
+            yield output_dict, data
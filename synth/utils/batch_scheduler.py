@@ -0,0 +1,45 @@
+from typing import Callable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+# Input lengths (in tokens) the inference servers commonly pad the batched prompts to
+DEFAULT_LENGTH_BUCKETS = (128, 256, 512, 1024, 2048)
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Estimate the number of tokens of a text without a tokenizer (about 4 characters per token for English text).
+
+    Args:
+        text (str): the text
+
+    Returns:
+        int: the approximate number of tokens
+    """
+    return len(text) // 4
+
+
+def group_by_bucket(items: Sequence[T],
+                    key_len: Callable[[T], int],
+                    buckets: Sequence[int] = DEFAULT_LENGTH_BUCKETS) -> List[List[int]]:
+    """
+    Group items by the smallest length bucket fitting them, so each group can be sent to the engine with little padding.
+
+    Args:
+        items (Sequence[T]): the items to group
+        key_len (Callable[[T], int]): the function giving the length of an item
+        buckets (Sequence[int]): the upper bounds of the length buckets, the longer items are grouped together after the last one
+
+    Returns:
+        List[List[int]]: the indices of the items of each non-empty bucket, from the shortest bucket to the longest,
+            sorted by length within each bucket
+    """
+    bounds = sorted(buckets)
+    groups = [[] for _ in range(len(bounds) + 1)]
+
+    for idx in sorted(range(len(items)), key=lambda idx: key_len(items[idx])):
+        length = key_len(items[idx])
+        bucket = next((bucket for bucket, bound in enumerate(bounds) if length <= bound), len(bounds))
+        groups[bucket].append(idx)
+
+    return [group for group in groups if group]
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import orjson
+
+
+def hash_key(*parts: Any) -> str:
+    """
+    Build a cache key by hashing the given parts.
+
+    Args:
+        *parts (Any): the values identifying the cached entry
+
+    Returns:
+        str: the hex digest of the parts
+    """
+    return hashlib.blake2b("\x00".join(map(str, parts)).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int) -> None:
+        """
+        A thread-safe in-memory cache evicting the least recently used entries.
+
+        Args:
+            maxsize (int): the maximum number of entries to keep
+
+        Returns:
+            None
+        """
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get an entry from the cache.
+
+        Args:
+            key (str): the key of the entry
+
+        Returns:
+            Optional[Any]: the cached value, or None if the key is not cached
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+
+            self._entries.move_to_end(key)
+
+            return self._entries[key]
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Add an entry to the cache, evicting the least recently used one if the cache is full.
+
+        Args:
+            key (str): the key of the entry
+            value (Any): the value to cache
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+class DiskCache:
+    def __init__(self, path: str) -> None:
+        """
+        A thread-safe cache persisted in a SQLite database, which can be shared by several processes and runs.
+
+        Args:
+            path (str): the path to the database file, created if it does not exist
+
+        Returns:
+            None
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        # Write-ahead logging lets the other processes read while one of them writes
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get an entry from the cache.
+
+        Args:
+            key (str): the key of the entry
+
+        Returns:
+            Optional[Any]: the cached value, or None if the key is not cached
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+
+        return None if row is None else orjson.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Add an entry to the cache.
+
+        Args:
+            key (str): the key of the entry
+            value (Any): the value to cache, which must be JSON serializable
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", (key, orjson.dumps(value)))
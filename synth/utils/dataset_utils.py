@@ -1,12 +1,18 @@
-from typing import Dict, List, Union
+from typing import Dict, Iterable, List, Optional, Union
 
 import datasets
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 from datasets.dataset_dict import DatasetDict
 
 from .io_utils import load_json, load_jsonl, load_txt
 from .text_utils import text_to_list
 
+# The columns that can contain the instructions, by priority
+INSTRUCTIONS_KEYS = ["instructions", "message_1", "instruction", "prompt", "text",
+                     "query", "user", "question", "conversation", "conversations"]
+
 
 def load_dataset(dataset_name: str) -> List[str]:
     """
@@ -29,19 +35,20 @@ def load_dataset(dataset_name: str) -> List[str]:
         instructions = dataset[instruction_key].tolist()
 
     elif isinstance(dataset, DatasetDict):
-        instructions = dataset["train"][instruction_key]
+        # Only the instructions column is converted, the rows without an instruction are dropped
+        instructions = dataset["train"].select_columns([instruction_key]).to_pandas()[instruction_key].dropna()
 
-        formatted_instructions = []
+        # Arrow list columns are converted to numpy arrays
+        instructions = instructions.map(lambda instruction: instruction.tolist() if isinstance(instruction, np.ndarray) else instruction)
+        instructions = instructions.astype(object)
 
-        for instruction in instructions:
-            if instruction.startswith("[") and instruction.endswith("]"):
-                instruction = text_to_list(instruction)
+        # Only the list-encoded strings are parsed, the conversations are already lists of turns
+        if instruction_key not in ["conversations", "conversation"]:
+            is_list_string = instructions.str.startswith("[", na=False) & instructions.str.endswith("]", na=False)
+            instructions.loc[is_list_string] = instructions.loc[is_list_string].map(text_to_list)
+            instructions = instructions.map(lambda instruction: instruction[0] if isinstance(instruction, list) else instruction)
 
-            if isinstance(instruction, list):
-                instruction = instruction[0]
-
-            formatted_instructions.append(instruction)
-        instructions = formatted_instructions
+        instructions = instructions.tolist()
 
     elif isinstance(dataset, list):
         instructions = []
@@ -86,12 +93,33 @@ def load_local_file(path: str) -> List[str]:
     elif path.endswith(".jsonl"):
         return load_jsonl(path)
     elif path.endswith(".csv"):
-        return pd.read_csv(path)
+        # Read the header first, so only the instructions column is parsed
+        instructions_key = pick_instructions_key(pd.read_csv(path, nrows=0).columns)
+
+        return pd.read_csv(path, usecols=[instructions_key] if instructions_key is not None else None)
     elif path.endswith(".parquet"):
-        return pd.read_parquet(path)
+        # Read the schema first, so only the instructions column is loaded
+        instructions_key = pick_instructions_key(pq.read_schema(path).names)
 
+        return pq.read_table(path, columns=[instructions_key] if instructions_key is not None else None).to_pandas()
 
-def find_instructions_key(data: Union[pd.DataFrame, Dict[str, str], DatasetDict]) -> str:
+
+def pick_instructions_key(columns: Iterable[str]) -> Optional[str]:
+    """
+    Pick the column that contains instructions.
+
+    Args:
+        columns (Iterable[str]): the column names
+
+    Returns:
+        Optional[str]: the column that contains instructions, None if there is none
+    """
+    columns = set(columns)
+
+    return next((key for key in INSTRUCTIONS_KEYS if key in columns), None)
+
+
+def find_instructions_key(data: Union[pd.DataFrame, Dict[str, str], DatasetDict]) -> Optional[str]:
     """
     Find the key in the data that contains instructions.
 
@@ -99,24 +127,41 @@ def find_instructions_key(data: Union[pd.DataFrame, Dict[str, str], DatasetDict]
         data (List[str]): the data to search
 
     Returns:
-        str: the key that contains instructions
+        Optional[str]: the key that contains instructions, None if there is none
     """
-    possible_keys = ["instructions", "message_1", "instruction", "prompt", "text",
-                     "query", "user", "question", "conversation", "conversations"]
-
     if isinstance(data, pd.DataFrame):
-        columns = data.columns
-
-        for key in possible_keys:
-            if key in columns:
-                return key
+        return pick_instructions_key(data.columns)
 
     if isinstance(data, DatasetDict):
-        for key in possible_keys:
-            if key in data.column_names["train"]:
-                return key
+        return pick_instructions_key(data.column_names["train"])
 
     if isinstance(data, list):
-        for key in possible_keys:
-            if key in data[0].keys():
-                return key
+        return pick_instructions_key(data[0].keys())
+
+
+def split_dataset(dataset: List[str], num_chunks: int) -> List[List[str]]:
+    """
+    Split a dataset into contiguous chunks whose sizes differ by at most one element.
+
+    Args:
+        dataset (List[str]): the dataset to split
+        num_chunks (int): the number of chunks to create
+
+    Returns:
+        List[List[str]]: the chunks, without the empty ones if the dataset has less than `num_chunks` elements
+    """
+    chunk_size, remainder = divmod(len(dataset), num_chunks)
+
+    chunks = []
+    start = 0
+
+    for chunk_index in range(num_chunks):
+        # The first `remainder` chunks take one extra element
+        end = start + chunk_size + (1 if chunk_index < remainder else 0)
+
+        if end > start:
+            chunks.append(dataset[start:end])
+
+        start = end
+
+    return chunks
@@ -1,10 +1,62 @@
+import contextlib
 import glob
-import json
 import os
-from typing import Dict, List, Union
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Union
 
+import orjson
 import yaml
 
+# Records with a `to_dict` method (e.g. `ImprovementRecord`) are saved as the dictionary it returns
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def _to_json(obj: Any) -> Any:
+    """
+    Convert an object orjson cannot serialize natively, used as its `default` hook.
+
+    Args:
+        obj (Any): the object to convert
+
+    Returns:
+        Any: the dictionary returned by the object's `to_dict` method
+
+    Raises:
+        TypeError: if the object has no `to_dict` method
+    """
+    if hasattr(obj, "to_dict"):
+        return obj.to_dict()
+
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+@contextlib.contextmanager
+def _atomic_open(path: str) -> Iterator[BinaryIO]:
+    """
+    Open a file to write it in binary mode, replacing `path` only once it is fully written.
+
+    Args:
+        path (str): path to the file
+
+    Returns:
+        Iterator[BinaryIO]: the temporary file, renamed to `path` when the context exits without error
+    """
+    temp_path = f"{path}.tmp"
+
+    try:
+        with open(temp_path, "wb") as f:
+            yield f
+
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+
+        raise
+
+
+# The libyaml loader is only available when PyYAML was built against it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 def load_jsonl(path: str) -> List[Dict[str, str]]:
     """
@@ -16,8 +68,8 @@ def load_jsonl(path: str) -> List[Dict[str, str]]:
     Returns:
         List[Dict[str, str]]: the jsonl file
     """
-    with open(path, "r", encoding="utf8") as f:
-        return [json.loads(line) for line in f]
+    with open(path, "rb") as f:
+        return [orjson.loads(line) for line in f]
 
 
 def load_txt(path: str) -> List[str]:
@@ -28,10 +80,10 @@ def load_txt(path: str) -> List[str]:
         path (str): path to the txt file
 
     Returns:
-        List[str]: the txt file
+        List[str]: the lines of the txt file, without their line endings
     """
     with open(path, "r", encoding="utf8") as f:
-        return f.readlines()
+        return f.read().splitlines()
 
 
 def save_json(path: str, data: dict) -> None:
@@ -45,8 +97,104 @@ def save_json(path: str, data: dict) -> None:
     Returns:
         None
     """
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
+    with _atomic_open(path) as f:
+        f.write(orjson.dumps(data, default=_to_json, option=_ORJSON_OPTIONS | orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+
+
+def save_jsonl(path: str, rows: Iterable[Any]) -> None:
+    """
+    Save rows to a jsonl file, one row per line.
+
+    Args:
+        path (str): path to the jsonl file
+        rows (Iterable[Any]): rows to save
+
+    Returns:
+        None
+    """
+    with open(path, "wb") as f:
+        append_jsonl(f, rows)
+
+
+def append_jsonl(file: BinaryIO, rows: Iterable[Any]) -> None:
+    """
+    Append rows to an open jsonl file, one row per line, and flush them to disk.
+
+    Args:
+        file (BinaryIO): the jsonl file, opened in binary mode
+        rows (Iterable[Any]): rows to append
+
+    Returns:
+        None
+    """
+    for row in rows:
+        file.write(orjson.dumps(row, default=_to_json, option=_ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE))
+
+    file.flush()
+
+
+def iter_jsonl(path: str) -> Iterator[Any]:
+    """
+    Lazily read the rows of a jsonl file.
+
+    Args:
+        path (str): path to the jsonl file
+
+    Returns:
+        Iterator[Any]: the rows of the jsonl file
+    """
+    with open(path, "rb") as f:
+        for line in f:
+            yield orjson.loads(line)
+
+
+def load_checkpoint(path: str) -> List[Any]:
+    """
+    Load the rows of a jsonl checkpoint, if it exists.
+
+    A process killed while appending to the checkpoint can leave a truncated last line, which is dropped.
+
+    Args:
+        path (str): path to the jsonl checkpoint
+
+    Returns:
+        List[Any]: the rows of the checkpoint, empty if it does not exist
+    """
+    if not os.path.exists(path):
+        return []
+
+    rows = []
+    try:
+        for row in iter_jsonl(path):
+            rows.append(row)
+    except orjson.JSONDecodeError:
+        pass
+
+    return rows
+
+
+def save_json_array(path: str, rows: Iterable[Any]) -> None:
+    """
+    Save rows to a json file as a list, writing them one at a time.
+
+    The output is the same as `save_json(path, list(rows))` without holding all the rows in memory.
+
+    Args:
+        path (str): path to the json file
+        rows (Iterable[Any]): rows to save
+
+    Returns:
+        None
+    """
+    with _atomic_open(path) as f:
+        f.write(b"[")
+        separator = b"\n  "
+        for row in rows:
+            f.write(separator)
+            # Indent the row by one level to nest it in the list
+            f.write(orjson.dumps(row, default=_to_json, option=_ORJSON_OPTIONS | orjson.OPT_INDENT_2).replace(b"\n", b"\n  "))
+            separator = b",\n  "
+        f.write(b"]\n" if separator == b"\n  " else b"\n]\n")
 
 
 def load_json(path: str) -> Union[Dict[str, str], List[Dict[str, str]]]:
@@ -59,8 +207,8 @@ def load_json(path: str) -> Union[Dict[str, str], List[Dict[str, str]]]:
     Returns:
         Union[Dict[str, str], List[Dict[str, str]]]: the json file
     """
-    with open(path, "r", encoding="utf8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
 
 
 def load_yaml(file_path):
@@ -75,65 +223,67 @@ def load_yaml(file_path):
     """
     try:
         with open(file_path, 'r') as file:
-            content = yaml.safe_load(file)
+            content = yaml.load(file, Loader=_YAML_LOADER)
         return content
     except Exception as e:
         print(f"Error reading the YAML file: {e}")
         return None
 
 
-def save_results(generated_dataset: Dict[str, str],
-                 processed_data: Dict[str, List[str]],
-                 skipped_data: List[str],
+def save_results(generated_dataset_files: List[str],
+                 processed_data_files: List[str],
+                 skipped_data_files: List[str],
                  output_path: str) -> None:
     """
-    Save the generated dataset, processed data, and skipped data to the output path.
+    Merge the per-chunk jsonl files into the generated dataset, processed data, and skipped data saved to the output path.
+
+    The rows are streamed from the chunk files, so the full results are never held in memory.
+    Each file is renamed into place once fully written, so a crash never leaves a partial result.
 
     Args:
-        generated_dataset (Dict[str, str]): the generated dataset
-        processed_data (Dict[str, List[str]]): the processed data
-        skipped_data (List[str]): the skipped data
+        generated_dataset_files (List[str]): the jsonl files holding the generated dataset of each chunk
+        processed_data_files (List[str]): the jsonl files holding the processed data of each chunk
+        skipped_data_files (List[str]): the jsonl files holding the skipped data of each chunk
+        output_path (str): the output path
 
     Returns:
         None
     """
+    os.makedirs(output_path, exist_ok=True)
 
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-
-    save_json(os.path.join(output_path, "generated_dataset.json"), generated_dataset)
-    save_json(os.path.join(output_path, "processed_data.json"), processed_data)
-    save_json(os.path.join(output_path, "skipped_data.json"), skipped_data)
+    for filename, chunk_files in (("generated_dataset.json", generated_dataset_files),
+                                  ("processed_data.json", processed_data_files),
+                                  ("skipped_data.json", skipped_data_files)):
+        rows = (row for chunk_file in chunk_files for row in iter_jsonl(chunk_file))
+        save_json_array(os.path.join(output_path, filename), rows)
 
-    temp_files = [i for i in glob.glob(f"{output_path}/*.json") if "_temp" in i]
+    temp_files = [i for i in glob.glob(f"{output_path}/*.json*") if "_temp" in i]
 
     for temp_file in temp_files:
-        os.remove(temp_file)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_file)
 
 
 def aggregate_temp_files(output_path: str) -> None:
     """
     Aggregate the temp files into the processed data and skipped data.
 
+    The per-chunk checkpoints are kept, so running the pipeline again resumes from them.
+
     Args:
         output_path (str): the output path
 
     Returns:
         None
     """
-    temp_files = [i for i in glob.glob(f"{output_path}/*.json") if "_temp" in i]
-
     temp_processed_data = []
     temp_skipped_data = []
 
-    for temp_file in temp_files:
-        data = load_json(temp_file)
-        if "processed_data" in temp_file:
-            temp_processed_data.extend(data)
-        elif "skipped_data" in temp_file:
-            temp_skipped_data.extend(temp_skipped_data)
+    for temp_file in glob.glob(f"{output_path}/_temp_processed_data_*.jsonl"):
+        temp_processed_data.extend(load_checkpoint(temp_file))
 
-        os.remove(temp_file)
+    for temp_file in glob.glob(f"{output_path}/_temp_skipped_data_*.jsonl"):
+        temp_skipped_data.extend(load_checkpoint(temp_file))
 
     if len(temp_processed_data) > 0:
         save_json(os.path.join(output_path, "_temp_processed_data.json"), temp_processed_data)
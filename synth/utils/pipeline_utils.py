@@ -1,15 +1,81 @@
 import random
 from collections import Counter
-from typing import List, Optional, Tuple
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import numpy as np
 
 
+@dataclass(slots=True)
+class ImprovementRecord:
+    """
+    An improvement step of an instruction, with the answers of the strong and target models and their scores.
+
+    The last step of an instruction holds the previous ones in `improvement_history`.
+    """
+    improvement_step: int
+    original_instruction: str
+    rubric: str
+    action: str
+    improved_instruction: str
+    strong_answer: str
+    target_answer: str
+    strong_score: float
+    target_score: float
+    improvement_history: Optional[List["ImprovementRecord"]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert the record to a dictionary, in the format saved to the output files.
+
+        Returns:
+            Dict[str, Any]: The record, without `improvement_history` when there is none.
+        """
+        record = {"improvement_step": self.improvement_step,
+                  "original_instruction": self.original_instruction,
+                  "rubric": self.rubric,
+                  "action": self.action,
+                  "improved_instruction": self.improved_instruction,
+                  "strong_answer": self.strong_answer,
+                  "target_answer": self.target_answer,
+                  "strong_score": self.strong_score,
+                  "target_score": self.target_score}
+
+        if self.improvement_history is not None:
+            record["improvement_history"] = [step.to_dict() for step in self.improvement_history]
+
+        return record
+
+    @classmethod
+    def from_dict(cls, record: Dict[str, Any]) -> "ImprovementRecord":
+        """
+        Build a record from a dictionary saved by `to_dict`.
+
+        Args:
+            record (Dict[str, Any]): The saved record.
+
+        Returns:
+            ImprovementRecord: The record.
+        """
+        history = record.get("improvement_history")
+
+        return cls(improvement_step=record["improvement_step"],
+                   original_instruction=record["original_instruction"],
+                   rubric=record["rubric"],
+                   action=record["action"],
+                   improved_instruction=record["improved_instruction"],
+                   strong_answer=record["strong_answer"],
+                   target_answer=record["target_answer"],
+                   strong_score=record["strong_score"],
+                   target_score=record["target_score"],
+                   improvement_history=None if history is None else [cls.from_dict(step) for step in history])
+
+
 def sample_random_action_and_rubric(rubrics: List[str],
                                     actions: List[str],
                                     n_instructions: int,
-                                    prev_samples: Optional[List[int]] = None,
-                                    decay_factor: Optional[float] = 0.8) -> Tuple[List[str], List[str], List[int]]:
+                                    prev_samples: Optional[Union[List[int], Counter]] = None,
+                                    decay_factor: float = 0.8) -> Tuple[List[str], List[str], List[int]]:
     """
     Sample a random action and rubric from the provided lists.
 
@@ -17,23 +83,26 @@ def sample_random_action_and_rubric(rubrics: List[str],
         rubrics (List[str]): the list of rubrics
         actions (List[str]): the list of actions
         n_instructions (int): the number of instructions to sample
-        prev_samples (Optional[List[int]]): the indices of previously sampled instructions
-        decay_factor (Optional[float]): the decay factor for the sampling weights
+        prev_samples (Optional[Union[List[int], Counter]]): the indices of previously sampled instructions, or their counts
+        decay_factor (float): the decay factor for the sampling weights
 
     Returns:
         Tuple[List[str], List[str], List[int]]: the sampled rubric, action, and indices
     """
-    sampling_weights = [1] * len(actions)
+    sample_counts = np.zeros(len(actions), dtype=np.int64)
 
     if prev_samples is not None and len(prev_samples) > 0:
-        sample_counts = Counter(prev_samples)
+        # A Counter is used as is, so callers sampling repeatedly can keep the counts up to date instead of rebuilding them
+        if isinstance(prev_samples, Counter):
+            sample_counts[list(prev_samples.keys())] = list(prev_samples.values())
+        else:
+            sample_counts = np.bincount(np.asarray(prev_samples, dtype=np.int64), minlength=len(actions))
 
-        for idx, count in sample_counts.items():
-            sampling_weights[idx] *= decay_factor ** count
+    sampling_weights = np.power(decay_factor, sample_counts)
 
-    indices = random.choices(range(len(actions)), k=n_instructions, weights=sampling_weights)
+    indices = random.choices(range(len(actions)), k=n_instructions, weights=sampling_weights.tolist())
 
-    action = np.array(actions)[indices].tolist()
-    rubric = np.array(rubrics)[indices].tolist()
+    action = [actions[idx] for idx in indices]
+    rubric = [rubrics[idx] for idx in indices]
 
     return rubric, action, indices
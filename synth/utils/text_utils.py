@@ -1,75 +1,72 @@
 import ast
 import re
-from typing import Dict, List, Tuple
-
-
-def extract_task_skills(input_string: str) -> Dict[str, str]:
+from typing import List, Optional, Tuple, Union
+
+# Compiled once, the extraction functions run on every engine output
+_TASK_SKILLS_RE = re.compile(
+    r"(?:Tasks?|Use cases?):\s*(?P<task>.+?)\s*(?:Needed skills?|Skills?):\s*(?P<skills>.+?)(?=\n\s*(?:Tasks?|Use cases?|Needed skills?|Skills?):|\Z)",
+    re.IGNORECASE | re.DOTALL
+)
+_INSTR_BACKUP_RE = re.compile(
+    r"(?:"
+    r"(?:(?:Instruction(?:s)?|Task(?:s)?|Question(?:s)?|\d+|\-|\*|\•)\.?\s*\d*[.:]*\s*(.+?))"
+    r"(?:\n(?=\d+|Instruction(?:s)?|Task(?:s)?|Question(?:s)?|\-|\*|\•|$)|$)"
+    r"|"
+    r"•\s*(.*?)(?=\n•|$)"
+    r")",
+    re.DOTALL
+)
+_INSTR_HEADER_RE = re.compile(r'^(Instructions?|Tasks?|Questions?|Items?)\s*[:]*$', re.IGNORECASE)
+_RUBRIC_NUMBERED_RE = re.compile(r'(?i)(\d+\.\s*Rubric(?:s)?(?: for .*?)?(?:[.:])?\s*(?P<rubric>.*?))\s*Actions?(?: to .*?)?(?:[.:])?\s*(?P<action>.*?)(?=\n\d+\.|\Z)',
+                                 re.DOTALL)
+_RUBRIC_PLAIN_RE = re.compile(r'Rubric:\s*(.*?)\nAction:\s*(.*?)(?=\nRubric:|\Z)', re.DOTALL)
+_RUBRIC_SECTION_RE = re.compile(r'rubric ', re.IGNORECASE)
+_ACTION_LABEL_RE = re.compile(r'action:', re.IGNORECASE)
+_RUBRIC_SPLIT_RE = re.compile(r'\n\s*-\s*|\n\s*Action:|\n\s*- Action:')
+_DIGITS_RE = re.compile(r'(?:\b((?:10|[0-9])(?:\.\d+)?)\s*[,/\s]\s*((?:10|[0-9])(?:\.\d+)?)\b)|(?:\b(?:Assistant\s+\d+\s+a\s+|\D+\s+)(\d+)\D+(?:Assistant\s+\d+\s+a\s+|\D+\s+)(\d+)\b)',
+                        re.IGNORECASE)
+_REASONING_RE = re.compile(r'Reasoning:\s*(.*?)\n\n', re.DOTALL | re.IGNORECASE)
+_SCORE_RE = re.compile(r'Score:\s*([-+]?[0-9]*\.?[0-9]+)\s*(?:points?)?', re.DOTALL | re.IGNORECASE)
+
+
+def extract_task_skills(input_string: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
     """
     Extract the task and skills from a string.
 
     Args:
-        input_string (str): the string to extract the task and skills from
+        input_string (Optional[str]): the string to extract the task and skills from, None when its request failed
 
     Returns:
-        Dict[str, str]: a dictionary containing the task and skills
+        Tuple[Optional[str], Optional[str]]: the task and skills, None if they could not be extracted
     """
-    tasks = []
-    skills = []
-
-    sections = re.split(r'(?:Task|Use case|Tasks|Use cases):\s*', input_string, flags=re.IGNORECASE)
-
-    for section in sections[1:]:
-        try:
-            task_part, skills_part = re.split(r'(?:Skills|Skill|Needed skills|Needed skill):\s*', section, flags=re.IGNORECASE)
-            task = task_part.strip()
-            skill = skills_part.strip()
-
-            tasks.append(task)
-            skills.append(skill)
-        except Exception:
-            tasks = []
-            skills = []
-
-            break
-
-    if not tasks:
-        pattern = (
-            r"(?:Use case|Task|Tasks|Use cases):\s*(?P<task>[^\n]+)\s*\n\s*"
-            r"(?:Skills|Skill|Needed skills|Needed skill):\s*(?P<skills>[^\n]+)"
-        )
-
-        matches = re.finditer(pattern, input_string, re.IGNORECASE)
-
-        for match in matches:
-            task = match.group('task').strip()
-            skill = match.group('skills').strip()
+    if input_string is None:
+        return None, None
 
-            tasks.append(task)
-            skills.append(skill)
+    match = _TASK_SKILLS_RE.search(input_string)
 
-    if not tasks:
+    if match is None:
         return None, None
 
-    return tasks[0], skills[0]
+    return match.group("task").strip(), match.group("skills").strip()
 
 
-def extract_instructions(input_string: str) -> List[str]:
+def extract_instructions(input_string: Optional[str]) -> List[str]:
     """
     Extract the instructions from a string.
 
     Args:
-        input_string (str): the string to extract the instructions from
+        input_string (Optional[str]): the string to extract the instructions from, None when its request failed
 
     Returns:
         List[str]: a list of instructions
     """
+    if input_string is None:
+        return []
+
     splits = input_string.replace("*", "").split(":\n\n")
 
     if len(splits) > 2:
-        input_string = ""
-
-        for split in splits[1:]:
-            input_string += split
+        input_string = "".join(splits[1:])
     elif len(splits) == 2:
         input_string = splits[-1]
     elif len(splits) < 2:
@@ -102,16 +99,7 @@ def extract_instructions(input_string: str) -> List[str]:
 
     # Further backup method: regex if no instructions or tasks found
     if not filtered_instructions:
-        pattern = (
-            r"(?:"
-            r"(?:(?:Instruction(?:s)?|Task(?:s)?|Question(?:s)?|\d+|\-|\*|\•)\.?\s*\d*[.:]*\s*(.+?))"
-            r"(?:\n(?=\d+|Instruction(?:s)?|Task(?:s)?|Question(?:s)?|\-|\*|\•|$)|$)"
-            r"|"
-            r"•\s*(.*?)(?=\n•|$)"
-            r")"
-        )
-
-        matches = re.findall(pattern, input_string, re.DOTALL)
+        matches = _INSTR_BACKUP_RE.findall(input_string)
 
         # Extract non-empty matches and strip whitespace
         instructions = [match[0] or match[1] for match in matches if (match[0].strip() or match[1].strip())]
@@ -121,33 +109,37 @@ def extract_instructions(input_string: str) -> List[str]:
         for instruction in instructions:
             instruction = instruction.strip()
 
-            if len(instruction) > 10 and not re.match(r'^(Instructions?|Tasks?|Questions?|Items?)\s*[:]*$', instruction, re.IGNORECASE):
+            if len(instruction) > 10 and not _INSTR_HEADER_RE.match(instruction):
                 filtered_instructions.append(instruction)
 
     return filtered_instructions
 
 
-def extract_rubric_action(input_string: str) -> Tuple[List[str], List[str]]:
+def extract_rubric_action(input_string: Optional[str]) -> Tuple[List[str], List[str]]:
     """
     Extract the rubric and action from a string.
 
     Args:
-        input_string (str): the string to extract the rubric and action from
+        input_string (Optional[str]): the string to extract the rubric and action from, None when its request failed
 
     Returns:
         Tuple[List[str], List[str]]: a tuple of two lists containing rubrics and actions
     """
+    if input_string is None:
+        return [], []
+
     # Remove any unnecessary characters
     input_string = input_string.replace("*", "").strip()
 
     rubrics = []
     actions = []
 
-    sections = input_string.lower().split("rubric ")
+    # Split case-insensitively, so the rubrics and actions keep their case
+    sections = _RUBRIC_SECTION_RE.split(input_string)
     for section in sections[1:]:
         try:
             _, rest = section.split(":", 1)
-            rubric_text, action_text = rest.lower().split("action:", 1)
+            rubric_text, action_text = _ACTION_LABEL_RE.split(rest, maxsplit=1)
 
             rubric_text = rubric_text.strip()
             action_text = action_text.strip()
@@ -163,17 +155,14 @@ def extract_rubric_action(input_string: str) -> Tuple[List[str], List[str]]:
 
     # Backup method if no rubrics or actions are found
     if not rubrics or not actions:
-        pattern_numbered = r'(?i)(\d+\.\s*Rubric(?:s)?(?: for .*?)?(?:[.:])?\s*(?P<rubric>.*?))\s*Actions?(?: to .*?)?(?:[.:])?\s*(?P<action>.*?)(?=\n\d+\.|\Z)'
-        pattern = r'Rubric:\s*(.*?)\nAction:\s*(.*?)(?=\nRubric:|\Z)'
-
         # First, try to match using the numbered pattern
-        matches = re.finditer(pattern_numbered, input_string, re.DOTALL)
+        matches = _RUBRIC_NUMBERED_RE.finditer(input_string)
         for match in matches:
             rubric_text = match.group('rubric').strip()
             action_text = match.group('action').strip()
 
-            rubric_entries = re.split(r'\n\s*-\s*|\n\s*Action:|\n\s*- Action:', rubric_text)
-            action_entries = re.split(r'\n\s*-\s*|\n\s*Action:|\n\s*- Action:', action_text)
+            rubric_entries = _RUBRIC_SPLIT_RE.split(rubric_text)
+            action_entries = _RUBRIC_SPLIT_RE.split(action_text)
 
             # Removing any leading or trailing whitespace from the first entry
             rubric_entries[0] = rubric_entries[0].strip()
@@ -185,7 +174,7 @@ def extract_rubric_action(input_string: str) -> Tuple[List[str], List[str]]:
 
         # If no matches found using the numbered pattern, use the non-numbered pattern
         if not rubrics and not actions:
-            matches = re.finditer(pattern, input_string, re.DOTALL)
+            matches = _RUBRIC_PLAIN_RE.finditer(input_string)
             for match in matches:
                 rubric_text = match.group(1).strip()
                 action_text = match.group(2).strip()
@@ -195,19 +184,21 @@ def extract_rubric_action(input_string: str) -> Tuple[List[str], List[str]]:
     return rubrics, actions
 
 
-def extract_digits(input_string: str) -> Tuple[int, int]:
+def extract_digits(input_string: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
     """
     Extract two digits from a string.
 
     Args:
-        input_string (str): the string to extract the digits from
+        input_string (Optional[str]): the string to extract the digits from, None when its request failed
 
     Returns:
-        Tuple[int, int]: a tuple containing the two digits
+        Tuple[Optional[int], Optional[int]]: a tuple containing the two digits, None if they could not be extracted
     """
+    if input_string is None:
+        return None, None
+
     input_string = input_string.strip()
-    pattern = r'(?:\b((?:10|[0-9])(?:\.\d+)?)\s*[,/\s]\s*((?:10|[0-9])(?:\.\d+)?)\b)|(?:\b(?:Assistant\s+\d+\s+a\s+|\D+\s+)(\d+)\D+(?:Assistant\s+\d+\s+a\s+|\D+\s+)(\d+)\b)'
-    match = re.search(pattern, input_string, re.IGNORECASE)
+    match = _DIGITS_RE.search(input_string)
 
     if match:
         if match.group(1) and match.group(2):
@@ -222,7 +213,7 @@ def extract_digits(input_string: str) -> Tuple[int, int]:
     return None, None
 
 
-def text_to_list(input_string: str) -> List[str]:
+def text_to_list(input_string: str) -> Union[List[str], str]:
     """
     Convert a string to a list of strings.
 
@@ -230,7 +221,7 @@ def text_to_list(input_string: str) -> List[str]:
         input_string (str): the string to convert to a list
 
     Returns:
-        List[str]: a list of strings
+        Union[List[str], str]: a list of strings, or the input string if it is not a list literal
     """
     try:
         return ast.literal_eval(input_string)
@@ -238,28 +229,27 @@ def text_to_list(input_string: str) -> List[str]:
         return input_string
 
 
-def extract_reasoning_and_score(input_string: str) -> Tuple[str, float]:
+def extract_reasoning_and_score(input_string: Optional[str]) -> Tuple[Optional[str], Optional[float]]:
     """
     Extract the reasoning and score from a string.
 
     Args:
-        input_string (str): the string to extract the reasoning and score from
+        input_string (Optional[str]): the string to extract the reasoning and score from, None when its request failed
 
     Returns:
-        Tuple[str, float]: a tuple containing the reasoning as a string and the score as a float
+        Tuple[Optional[str], Optional[float]]: a tuple containing the reasoning as a string and the score as a float, None if it could not be extracted
     """
-    # Patterns to capture the reasoning and score
-    reasoning_pattern = re.compile(r'Reasoning:\s*(.*?)\n\n', re.DOTALL | re.IGNORECASE)
-    score_pattern = re.compile(r'Score:\s*([-+]?[0-9]*\.?[0-9]+)\s*(?:points?)?', re.DOTALL | re.IGNORECASE)
+    if input_string is None:
+        return None, None
 
     # Find matches for reasoning and score
-    reasoning_match = reasoning_pattern.search(input_string)
-    score_match = score_pattern.search(input_string)
+    reasoning_match = _REASONING_RE.search(input_string)
+    score_match = _SCORE_RE.search(input_string)
 
     # Extract and clean the reasoning text
     reasoning = reasoning_match.group(1).strip() if reasoning_match else ""
 
     # Extract and convert the score to a float
-    score = float(score_match.group(1))
+    score = float(score_match.group(1)) if score_match else None
 
     return reasoning, score